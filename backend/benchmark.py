@@ -0,0 +1,255 @@
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from backend.category import score_stress
+from backend.recommend_bpm import BANDS, score_frame
+from backend.genre_model import GenreModel, read_genre_log
+
+# Modules that must not load until a session actually needs them
+LAZY_MODULES = ("cv2", "pyaudio", "mss", "PIL", "google.genai")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NUM_CHANNELS = 32
+FEATURES = [
+    "psd_delta", "psd_theta", "psd_alpha", "psd_beta", "psd_gamma",
+    "theta_beta_ratio", "theta_alpha_ratio", "alpha_beta_ratio",
+    "spectral_entropy_value", "sample_entropy_value",
+    "delta_rel_power", "theta_rel_power", "alpha_rel_power", "beta_rel_power",
+]
+
+
+def synthetic_eeg_frame(rows, channels=NUM_CHANNELS, seed=0):
+    """Random frame with the same `<channel>.<feature>` header as our exports."""
+    rng = np.random.default_rng(seed)
+    columns = [f"{ch}.{feat}" for ch in range(channels) for feat in FEATURES]
+    return pd.DataFrame(rng.random((rows, len(columns))), columns=columns)
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_scoring(rows):
+    df = synthetic_eeg_frame(rows)
+    batch = timed(lambda: score_frame(df))
+
+    def per_row():
+        # What the endpoint used to do: rescan the header and score iloc[0], once per row
+        for i in range(min(rows, 200)):
+            row = df.iloc[[i]]
+            for band in BANDS:
+                cols = [col for col in row.columns if f"{band}_rel_power" in col]
+                row[cols].mean(axis=1).fillna(0).iloc[0]
+
+    sampled = timed(per_row, repeat=1)
+    stress = timed(lambda: score_stress(df))
+    print(f"score_frame: {rows} rows in {batch * 1000:.2f} ms")
+    print(f"score_stress: {rows} rows x {NUM_CHANNELS} channels in {stress * 1000:.2f} ms")
+    print(f"per-row loop: ~{sampled / min(rows, 200) * rows * 1000:.0f} ms (extrapolated)")
+
+
+def bench_genre(samples, log_path=None, llm=False):
+    bpms, calmness_scores, genres = read_genre_log(log_path)
+    if len(genres) < 10:
+        # No usable log: synthetic answers where genre follows BPM
+        rng = np.random.default_rng(0)
+        bpms = rng.uniform(50, 130, samples)
+        calmness_scores = rng.uniform(0, 3, samples)
+        names = np.array(["Ambient", "Lo-fi", "Pop", "EDM"])
+        genres = list(names[np.digitize(bpms, [70, 90, 110])])
+    bpms, calmness_scores = np.asarray(bpms), np.asarray(calmness_scores)
+
+    # Hold out every 5th answer to measure agreement with the LLM labels
+    held = np.arange(len(genres)) % 5 == 0
+    model = GenreModel().fit(bpms[~held], calmness_scores[~held], [g for g, h in zip(genres, held) if not h])
+    best, confidence = model.predict_batch(bpms[held], calmness_scores[held])
+    predicted = [model.genres[i].casefold() for i in best]
+    expected = [g.strip().casefold() for g, h in zip(genres, held) if h]
+    agree = np.array([p == e for p, e in zip(predicted, expected)])
+    confident = confidence >= 0.8
+
+    single = timed(lambda: model.predict(bpms[0], calmness_scores[0]), repeat=100)
+    print(f"genre model: {len(model)} answers, {len(model.genres)} genres")
+    print(f"local predict: {single * 1e6:.0f} us per call")
+    print(f"agreement with LLM: {agree.mean():.0%} overall, "
+          f"{agree[confident].mean() if confident.any() else float('nan'):.0%} on the {confident.mean():.0%} answered locally")
+
+    if llm:
+        from backend.recommend_genre import llm_genre
+
+        start = time.perf_counter()
+        llm_genre(float(bpms[0]), {"calmness_score": float(calmness_scores[0])})
+        print(f"LLM path: {(time.perf_counter() - start) * 1000:.0f} ms per call")
+
+
+def peak_allocated(fn):
+    """Peak bytes allocated by one call to fn (Python-tracked allocations only)."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_frames(width, height, quality, max_size):
+    import cv2
+    import PIL.Image
+
+    from backend.frame_encoding import FrameEncoder
+
+    rng = np.random.default_rng(0)
+    # Smooth gradients plus noise, closer to a camera frame than pure noise
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    bgr = np.clip(base + rng.normal(0, 8, base.shape), 0, 255).astype(np.uint8)
+    bgra = cv2.cvtColor(bgr, cv2.COLOR_BGR2BGRA)
+
+    def legacy_camera():
+        img = PIL.Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+        img.thumbnail([max_size, max_size])
+        image_io = io.BytesIO()
+        img.save(image_io, format="jpeg", quality=quality)
+        return image_io.getvalue()
+
+    def legacy_screen():
+        # The old screen path: BGRA -> RGB bytes -> PNG -> PIL -> JPEG
+        import mss.tools
+
+        rgb = cv2.cvtColor(bgra, cv2.COLOR_BGRA2RGB).tobytes()
+        png = mss.tools.to_png(rgb, (width, height))
+        img = PIL.Image.open(io.BytesIO(png))
+        image_io = io.BytesIO()
+        img.save(image_io, format="jpeg", quality=quality)
+        return image_io.getvalue()
+
+    encoder = FrameEncoder(max_size=max_size, quality=quality)
+    encoder.encode_bgr(bgr)
+    encoder.encode_bgra(bgra)
+
+    cases = [
+        ("camera, PIL", legacy_camera),
+        ("camera, FrameEncoder", lambda: encoder.encode_bgr(bgr)),
+        ("screen, PNG+PIL", legacy_screen),
+        ("screen, FrameEncoder", lambda: encoder.encode_bgra(bgra)),
+    ]
+    print(f"{width}x{height} frame, quality {quality}, max size {max_size}")
+    for name, fn in cases:
+        elapsed = timed(fn, repeat=10)
+        size = len(fn())
+        print(f"{name:>22}: {elapsed * 1000:7.2f} ms, {size / 1024:6.1f} KiB, "
+              f"peak alloc {peak_allocated(fn) / 1024:8.1f} KiB")
+
+
+def bench_columnar(rows):
+    from backend.eeg_columnar import convert_csv, load_columnar
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "eeg.csv")
+        synthetic_eeg_frame(rows).to_csv(path, index=False)
+        convert_csv(path)
+
+        def from_csv():
+            return score_frame(pd.read_csv(path))
+
+        def from_columnar():
+            return score_frame(load_columnar(path))
+
+        csv_scores, columnar_scores = from_csv(), from_columnar()
+        drift = max(float(np.nanmax(np.abs(csv_scores[k] - columnar_scores[k]))) for k in csv_scores)
+        csv_size = os.path.getsize(path)
+        npy_size = os.path.getsize(os.path.splitext(path)[0] + ".npy")
+        print(f"{rows} rows: CSV {csv_size / 1024 / 1024:.1f} MiB, columnar {npy_size / 1024 / 1024:.1f} MiB")
+        for name, fn in (("read_csv + score", from_csv), ("mmap + score", from_columnar)):
+            print(f"{name:>18}: {timed(fn) * 1000:8.2f} ms, peak alloc {peak_allocated(fn) / 1024:9.1f} KiB")
+        print(f"max score difference (float32 storage): {drift:.2e}")
+
+
+def bench_trends(rows, window, stride):
+    from backend.eeg_trends import trend_frame
+
+    df = synthetic_eeg_frame(rows)
+    rolling = timed(lambda: trend_frame(df, window, stride, max_points=None))
+    points = len(trend_frame(df, window, stride, max_points=None)["window_start"])
+
+    def per_window():
+        # Score every row, then a pandas .mean() per window
+        scores = pd.DataFrame(score_frame(df))
+        for start in range(0, rows - window + 1, stride):
+            scores.iloc[start:start + window].mean()
+
+    print(f"trend_frame: {points} windows of {window} rows in {rolling * 1000:.2f} ms")
+    print(f"per-window pandas mean: {timed(per_window, repeat=1) * 1000:.2f} ms")
+
+
+def bench_imports(module, budget_ms, repeat=3):
+    """Cold-import `module` in fresh interpreters; fail if it is over budget or loads LAZY_MODULES."""
+    probe = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(json.dumps([elapsed, [m for m in {LAZY_MODULES!r} if m in sys.modules]]))\n"
+    )
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", probe], cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        )
+        elapsed, loaded = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(elapsed)
+    best = min(timings) * 1000
+    print(f"import {module}: {best:.0f} ms (best of {repeat}, budget {budget_ms} ms)")
+    print(f"heavy modules loaded at import: {', '.join(loaded) or 'none'}")
+    if best > budget_ms or loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "benchmark",
+        choices=["scoring", "genre", "frames", "imports", "columnar", "trends"],
+        help="which benchmark to run",
+    )
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--samples", type=int, default=2000, help="synthetic answers when there is no genre log")
+    parser.add_argument("--genre-log", help="genre log to evaluate against")
+    parser.add_argument("--llm", action="store_true", help="also time one real LLM genre call")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--quality", type=int, default=75, help="JPEG quality for the frame benchmark")
+    parser.add_argument("--max-size", type=int, default=1024, help="longest frame side after resizing")
+    parser.add_argument("--window", type=int, default=30, help="rows per window for the trend benchmark")
+    parser.add_argument("--stride", type=int, default=1, help="rows between windows for the trend benchmark")
+    parser.add_argument("--module", default="main", help="module to cold-import for the import benchmark")
+    parser.add_argument("--budget-ms", type=float, default=1500, help="import-time budget")
+    args = parser.parse_args()
+    if args.benchmark == "scoring":
+        bench_scoring(args.rows)
+    elif args.benchmark == "genre":
+        bench_genre(args.samples, args.genre_log, args.llm)
+    elif args.benchmark == "frames":
+        bench_frames(args.width, args.height, args.quality, args.max_size)
+    elif args.benchmark == "imports":
+        bench_imports(args.module, args.budget_ms)
+    elif args.benchmark == "columnar":
+        bench_columnar(args.rows)
+    elif args.benchmark == "trends":
+        bench_trends(args.rows, args.window, args.stride)
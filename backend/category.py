@@ -1,38 +1,74 @@
-import pandas as pd
-import json
+import numpy as np
 
-def calculate_stress_json(file_path):
-    # Load single-row EEG dataset
-    df = pd.read_csv(file_path).head(1)
-    
-    # Drop unnamed column if it exists
-    df = df.drop(columns=["Unnamed: 0"], errors='ignore')
-    
-    num_channels = 8
-    
-    # Extract row
-    row = df.iloc[0]
-    
-    # Calculate sums
-    beta_sum = sum(float(row[f"{ch}.psd_beta"]) for ch in range(num_channels))
-    gamma_sum = sum(float(row[f"{ch}.psd_gamma"]) for ch in range(num_channels))
-    
-    # Calculate stress values
-    stress_score = beta_sum / (gamma_sum + 1e-6)
-    stress_level = "Low" if stress_score < 0.8 else "Moderate" if stress_score < 1.5 else "High"
-    stress_type = "High mental workload / Anxiety" if beta_sum > gamma_sum else "Relaxed / Low stress"
-    
-    # Create JSON data (Python dictionary)
-    result_data = {
-        "stress_score": round(stress_score, 3),
-        "stress_level": stress_level,
-        "stress_type": stress_type,
+from backend.eeg_columnar import load_frame
+from backend.eeg_schema import get_schema
+
+# stress_score boundaries between the levels below
+STRESS_THRESHOLDS = (0.8, 1.5)
+STRESS_LEVELS = np.array(["Low", "Moderate", "High"])
+# Indexed by beta_sum > gamma_sum
+STRESS_TYPES = np.array(["Relaxed / Low stress", "High mental workload / Anxiety"])
+
+
+def stress_score(beta, gamma):
+    return beta / (gamma + 1e-6)
+
+
+def stress_level(score):
+    """Level name for each score, same shape as `score`."""
+    return STRESS_LEVELS[np.searchsorted(STRESS_THRESHOLDS, np.nan_to_num(score), side="right")]
+
+
+def stress_type(beta, gamma):
+    return STRESS_TYPES[(np.asarray(beta) > np.asarray(gamma)).astype(np.intp)]
+
+
+def score_stress(df):
+    """Stress for every row (epoch) and channel of an EEG feature frame in one pass.
+
+    Channels come from the header, however many the file has. Returns a dict
+    of arrays: "beta_sum", "gamma_sum", "stress_score", "stress_level" and
+    "stress_type" of length len(df), plus "channel_stress_score" and
+    "channel_stress_level" of shape (rows, channels) and "channels" (names).
+    Missing cells are left out of the sums.
+    """
+    schema = get_schema(df.columns)
+    # (rows, channels, [beta, gamma])
+    psd = schema.select(df, ["psd_beta", "psd_gamma"])
+    beta, gamma = psd[..., 0], psd[..., 1]
+
+    beta_sum = np.nansum(beta, axis=1)
+    gamma_sum = np.nansum(gamma, axis=1)
+    score = stress_score(beta_sum, gamma_sum)
+    channel_score = np.nan_to_num(stress_score(beta, gamma))
+    return {
+        "channels": list(schema.channels),
         "beta_sum": beta_sum,
-        "gamma_sum": gamma_sum
+        "gamma_sum": gamma_sum,
+        "stress_score": score,
+        "stress_level": stress_level(score),
+        "stress_type": stress_type(beta_sum, gamma_sum),
+        "channel_stress_score": channel_score,
+        "channel_stress_level": stress_level(channel_score),
     }
-    
-    return result_data  # returns dictionary
 
-# Example usage
-json_data = calculate_stress_json("F_Relax_A_feature 3.csv")
-print(json_data)
\ No newline at end of file
+
+def calculate_stress_batch(file_path):
+    """Per-row and per-channel stress for a whole recording."""
+    # Memory-mapped columnar copy when the upload has one, else the CSV
+    return score_stress(load_frame(file_path))
+
+
+def stress_at(stress, row=0):
+    return {
+        "stress_score": round(float(stress["stress_score"][row]), 3),
+        "stress_level": str(stress["stress_level"][row]),
+        "stress_type": str(stress["stress_type"][row]),
+        "beta_sum": float(stress["beta_sum"][row]),
+        "gamma_sum": float(stress["gamma_sum"][row]),
+    }
+
+
+def calculate_stress_json(file_path):
+    """Stress of the first row, as a dictionary."""
+    return stress_at(calculate_stress_batch(file_path), 0)
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from backend.eeg_columnar import ColumnarFrame, load_frame
+from backend.recommend_bpm import score_frame, wave_data_at
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+HASH_CHUNK_SIZE = 1 << 20
+# Rough size charged for an entry holding only (bpm, wave_data)
+RESULT_BYTES = 1024
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ParsedUploadCache:
+    """LRU cache of parsed EEG frames and their (bpm, wave_data), keyed by content hash.
+
+    Paths are mapped to content hashes through their (mtime, size) stat, so a
+    poll on an unchanged upload neither re-hashes nor re-parses it. Entries are
+    evicted least-recently-used once the frames exceed `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("EEG_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def _stat_key(self, path):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def digest(self, path):
+        """Content hash of `path`, only re-hashed when the file changed on disk."""
+        path = os.path.abspath(path)
+        stat_key = self._stat_key(path)
+        with self._lock:
+            known = self._paths.get(path)
+        if known and known[0] == stat_key:
+            return known[1]
+        digest = file_digest(path)
+        with self._lock:
+            self._paths[path] = (stat_key, digest)
+        return digest
+
+    def register(self, path, digest, result=None):
+        """Record a freshly written upload, replacing whatever the path held before."""
+        path = os.path.abspath(path)
+        with self._lock:
+            known = self._paths.get(path)
+        # Content-addressed paths re-registered with the same hash keep their cached parse
+        if known is None or known[1] != digest:
+            self.invalidate(path)
+        with self._lock:
+            self._paths[path] = (self._stat_key(path), digest)
+        if result is not None:
+            self._store(digest, result=result)
+
+    def invalidate(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            known = self._paths.pop(path, None)
+            if known is None:
+                return
+            still_used = any(d == known[1] for _, d in self._paths.values())
+            if not still_used and known[1] in self._entries:
+                self.total_bytes -= self._entries.pop(known[1])["nbytes"]
+
+    def _store(self, digest, frame=None, result=None):
+        with self._lock:
+            entry = self._entries.pop(digest, {"frame": None, "result": None, "nbytes": 0})
+            self.total_bytes -= entry["nbytes"]
+            if frame is not None:
+                entry["frame"] = frame
+            if result is not None:
+                entry["result"] = result
+            entry["nbytes"] = RESULT_BYTES
+            # Memory-mapped frames live in the page cache, not on our heap
+            if entry["frame"] is not None and not isinstance(entry["frame"], ColumnarFrame):
+                entry["nbytes"] += int(entry["frame"].memory_usage(deep=True).sum())
+            self._entries[digest] = entry
+            self.total_bytes += entry["nbytes"]
+            # Evict least recently used, but never the entry just stored
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted["nbytes"]
+
+    def _lookup(self, digest, field):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry[field] is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[field]
+
+    def frame(self, path, digest=None):
+        """Parsed frame for `path` (columnar copy or DataFrame), loaded only on a cache miss.
+
+        Pass `digest` when the content hash is already known (e.g. a
+        content-addressed blob) to skip hashing the file.
+        """
+        digest = digest or self.digest(path)
+        df = self._lookup(digest, "frame")
+        if df is None:
+            df = load_frame(path)
+            self._store(digest, frame=df)
+        return df
+
+    def bpm_genre(self, path, digest=None):
+        """Cached equivalent of get_bpm_genre(path)."""
+        digest = digest or self.digest(path)
+        result = self._lookup(digest, "result")
+        if result is None:
+            scores = score_frame(self.frame(path, digest))
+            result = (float(scores["bpm"][0]), wave_data_at(scores, 0))
+            self._store(digest, result=result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,133 @@
+import argparse
+import contextlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+# CSV rows parsed (and held in memory) at a time while converting
+CONVERT_CHUNK_ROWS = int(os.environ.get("COLUMNAR_CHUNK_ROWS", 4096))
+
+
+def columnar_paths(path):
+    """(.npy array, .schema.json sidecar) stored next to a CSV."""
+    base, _ = os.path.splitext(os.path.abspath(path))
+    return f"{base}.npy", f"{base}.schema.json"
+
+
+def _source_stat(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class ColumnarFrame:
+    """Read-only, memory-mapped stand-in for the DataFrame of an EEG CSV.
+
+    Values are a column-major float32 array, so reading a few columns only
+    pages in those columns. Supports what the EEG readers need: `columns`,
+    len(), head() and column gathers through take().
+    """
+
+    def __init__(self, columns, values):
+        self.columns = list(columns)
+        self.values = values
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def head(self, n=5):
+        return ColumnarFrame(self.columns, self.values[:n])
+
+    def take(self, positions):
+        """float64 (rows, len(positions)) copy of the given columns."""
+        return np.asarray(self.values[:, positions], dtype=np.float64)
+
+
+def convert_csv(path, chunk_rows=CONVERT_CHUNK_ROWS):
+    """Parse `path` once and write its columnar copy; returns the .npy path.
+
+    Non-numeric cells become NaN. The CSV is parsed `chunk_rows` rows at a
+    time into a row-major scratch file, which is then copied block by block
+    into the column-major .npy, so only one chunk is ever in memory.
+    Written to temporary names and renamed, so readers never see a
+    half-written array.
+    """
+    npy_path, schema_path = columnar_paths(path)
+    tmp_raw = f"{npy_path}.tmp.raw"
+    tmp_npy = f"{npy_path}.tmp.npy"
+    columns = None
+    rows = 0
+    try:
+        with open(tmp_raw, "wb") as raw:
+            for chunk in pd.read_csv(path, chunksize=chunk_rows):
+                if columns is None:
+                    columns = [str(col) for col in chunk.columns]
+                values = chunk.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float32)
+                raw.write(values.tobytes())
+                rows += len(values)
+        if columns is None:
+            columns = [str(col) for col in pd.read_csv(path, nrows=0).columns]
+        shape = (rows, len(columns))
+        if rows and columns:
+            out = np.lib.format.open_memmap(tmp_npy, mode="w+", dtype=np.float32, shape=shape, fortran_order=True)
+            scratch = np.memmap(tmp_raw, dtype=np.float32, mode="r", shape=shape)
+            for start in range(0, rows, chunk_rows):
+                out[start:start + chunk_rows] = scratch[start:start + chunk_rows]
+            out.flush()
+            del out, scratch
+        else:
+            np.save(tmp_npy, np.zeros(shape, dtype=np.float32, order="F"))
+        os.replace(tmp_npy, npy_path)
+    finally:
+        for leftover in (tmp_raw, tmp_npy):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(leftover)
+    sidecar = {
+        "version": FORMAT_VERSION,
+        "columns": columns,
+        "dtype": "float32",
+        "shape": list(shape),
+        "source": _source_stat(path),
+    }
+    tmp_schema = f"{schema_path}.tmp"
+    with open(tmp_schema, "w") as f:
+        json.dump(sidecar, f)
+    os.replace(tmp_schema, schema_path)
+    return npy_path
+
+
+def load_columnar(path):
+    """Memory-mapped ColumnarFrame for `path`, or None if there is no up-to-date copy."""
+    npy_path, schema_path = columnar_paths(path)
+    try:
+        with open(schema_path) as f:
+            sidecar = json.load(f)
+        if sidecar.get("version") != FORMAT_VERSION or sidecar.get("source") != _source_stat(path):
+            return None
+        values = np.load(npy_path, mmap_mode="r")
+        if list(values.shape) != sidecar["shape"]:
+            return None
+        return ColumnarFrame(sidecar["columns"], values)
+    except (FileNotFoundError, ValueError, KeyError, TypeError, AttributeError):
+        # Missing, stale or malformed copy: readers fall back to the CSV
+        return None
+
+
+def load_frame(path):
+    """The columnar copy of an EEG CSV when there is one, else the CSV via pandas."""
+    frame = load_columnar(path)
+    return frame if frame is not None else pd.read_csv(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write columnar (.npy + schema) copies of EEG CSVs")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+    for csv_path in args.paths:
+        print(f"{csv_path} -> {convert_csv(csv_path)}")
@@ -0,0 +1,108 @@
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+from backend.eeg_columnar import ColumnarFrame
+
+_schema_cache = {}
+_schema_lock = threading.Lock()
+
+
+def _channel_key(channel):
+    return (0, int(channel), "") if channel.isdigit() else (1, 0, channel)
+
+
+class EEGSchema:
+    """Parsed `<channel>.<feature>` header of an EEG feature CSV.
+
+    `index[c, f]` is the position (into `positions`) of channel c / feature f,
+    or -1 when the file has no such column. `select()` uses it to fancy-index
+    the needed columns into a (rows, channels, features) array.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        channels, features, cells = [], [], []
+        for pos, col in enumerate(self.columns):
+            channel, sep, feature = str(col).partition(".")
+            if not sep or not channel or not feature:
+                continue
+            if channel not in channels:
+                channels.append(channel)
+            if feature not in features:
+                features.append(feature)
+            cells.append((channel, feature, pos))
+
+        self.channels = sorted(channels, key=_channel_key)
+        self.features = features
+        self.channel_index = {ch: i for i, ch in enumerate(self.channels)}
+        self.feature_index = {feat: i for i, feat in enumerate(self.features)}
+
+        # Source column positions of the channel/feature columns, in header order
+        self.positions = np.array([pos for _, _, pos in cells], dtype=np.intp)
+        self.index = np.full((len(self.channels), len(self.features)), -1, dtype=np.intp)
+        for i, (channel, feature, _) in enumerate(cells):
+            self.index[self.channel_index[channel], self.feature_index[feature]] = i
+
+    @property
+    def num_channels(self):
+        return len(self.channels)
+
+    def matrix(self, df, positions=None, pad=False):
+        """Channel/feature columns of `df` (or just `positions`) as a float64 2-D array.
+
+        `df` may be a DataFrame or a memory-mapped ColumnarFrame. With
+        `pad=True` an extra all-NaN column is appended, for `select()` to
+        point missing cells at.
+        """
+        positions = self.positions if positions is None else positions
+        if isinstance(df, ColumnarFrame):
+            values = df.take(positions)
+        else:
+            block = df.iloc[:, positions]
+            try:
+                values = block.to_numpy(dtype=np.float64)
+            except (TypeError, ValueError):
+                values = block.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+        if not pad:
+            return values
+        out = np.empty((values.shape[0], values.shape[1] + 1))
+        out[:, :-1] = values
+        out[:, -1] = np.nan
+        return out
+
+    def feature_index_for(self, features):
+        """(channels, len(features)) slice of `index`, -1 for unknown features."""
+        index = np.full((self.num_channels, len(features)), -1, dtype=np.intp)
+        for j, feature in enumerate(features):
+            if feature in self.feature_index:
+                index[:, j] = self.index[:, self.feature_index[feature]]
+        return index
+
+    def select(self, df, features):
+        """(rows, channels, features) array read straight from `df`, touching only the needed columns."""
+        index = self.feature_index_for(features)
+        used = np.unique(index[index >= 0])
+        compact = np.full_like(index, -1)
+        compact[index >= 0] = np.searchsorted(used, index[index >= 0])
+        values = self.matrix(df, self.positions[used], pad=True)
+        return values[:, np.where(compact < 0, len(used), compact)]
+
+
+def header_hash(columns):
+    return hashlib.sha1("\x1f".join(map(str, columns)).encode("utf-8")).hexdigest()
+
+
+def get_schema(columns):
+    """Return the cached EEGSchema for this header, parsing it on first use."""
+    key = header_hash(columns)
+    schema = _schema_cache.get(key)
+    if schema is None:
+        with _schema_lock:
+            schema = _schema_cache.get(key)
+            if schema is None:
+                schema = EEGSchema(columns)
+                _schema_cache[key] = schema
+    return schema
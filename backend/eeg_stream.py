@@ -0,0 +1,62 @@
+import csv
+import io
+
+import pandas as pd
+
+from backend.recommend_bpm import BANDS, score_frame, wave_data_at
+
+
+class StreamingBandAggregator:
+    """Incrementally score an EEG feature CSV as its bytes arrive.
+
+    feed() takes arbitrary byte chunks, parses the complete lines with pandas
+    and folds them into running band-power sums, so only one chunk is ever
+    held in memory. close() returns the same (bpm, wave_data) that
+    get_bpm_genre would compute for the file, plus recording-wide means.
+    """
+
+    def __init__(self):
+        self.columns = None
+        self.rows = 0
+        self.first = None
+        self._pending = b""
+        self._sums = {f"{band}_mean": 0.0 for band in BANDS}
+        self._sums["calmness_score"] = 0.0
+        self._sums["bpm"] = 0.0
+
+    def feed(self, data):
+        data = self._pending + data
+        cut = data.rfind(b"\n")
+        if cut < 0:
+            self._pending = data
+            return
+        self._pending = data[cut + 1:]
+        self._consume(data[:cut + 1])
+
+    def _consume(self, data):
+        text = data.decode("utf-8-sig" if self.columns is None else "utf-8")
+        if self.columns is None:
+            header, _, text = text.partition("\n")
+            self.columns = next(csv.reader([header.rstrip("\r")]))
+        if not text.strip():
+            return
+        df = pd.read_csv(io.StringIO(text), header=None, names=self.columns)
+        if df.empty:
+            return
+        scores = score_frame(df)
+        if self.first is None:
+            self.first = (float(scores["bpm"][0]), wave_data_at(scores, 0))
+        for key in self._sums:
+            self._sums[key] += float(scores[key].sum())
+        self.rows += len(df)
+
+    def close(self):
+        if self._pending.strip():
+            self._consume(self._pending + b"\n")
+        self._pending = b""
+        if self.first is None:
+            return None
+        bpm, wave_data = self.first
+        recording = {key: total / self.rows for key, total in self._sums.items()}
+        recording["bpm"] = round(recording["bpm"], 0)
+        return {"bpm": bpm, "wave_data": wave_data, "rows": self.rows, "recording": recording}
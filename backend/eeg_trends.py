@@ -0,0 +1,81 @@
+import math
+import os
+
+import numpy as np
+
+from backend.category import stress_score
+from backend.eeg_schema import get_schema
+from backend.recommend_bpm import BANDS, band_means, bpm_from_calmness, calmness_from_bands
+
+# Rows (epochs) per window and rows between window starts
+TREND_WINDOW = int(os.environ.get("TREND_WINDOW", 30))
+TREND_STRIDE = int(os.environ.get("TREND_STRIDE", 10))
+# Longest timeline returned; the stride is widened to stay under it
+TREND_MAX_POINTS = int(os.environ.get("TREND_MAX_POINTS", 500))
+
+
+def window_starts(rows, window, stride, max_points=None):
+    """First row of each window, the window length and the stride actually used.
+
+    A window longer than the recording shrinks to the whole recording. When
+    the stride does not land on the last row, one extra window is added that
+    ends there, so the timeline always reaches the end of the recording.
+    """
+    if rows == 0:
+        return np.zeros(0, dtype=np.intp), 0, stride
+    window = max(1, min(window, rows))
+    span = rows - window
+    if max_points and max_points > 1:
+        stride = max(stride, math.ceil(span / (max_points - 1)))
+    starts = np.arange(0, span + 1, max(stride, 1), dtype=np.intp)
+    if starts[-1] != span and (not max_points or len(starts) < max_points):
+        starts = np.append(starts, span)
+    return starts, window, stride
+
+
+def rolling_mean(values, starts, window):
+    """NaN-ignoring mean of values[s:s + window] (along axis 0) for every s in `starts`.
+
+    Two prefix sums (values and non-NaN counts) make every window O(1),
+    however long it is. Windows with no data come back as 0.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    mask = ~np.isnan(values)
+    zero = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate([zero, np.cumsum(np.where(mask, values, 0.0), axis=0)])
+    counts = np.concatenate([zero, np.cumsum(mask, axis=0)])
+    window_sums = sums[starts + window] - sums[starts]
+    window_counts = counts[starts + window] - counts[starts]
+    return np.divide(window_sums, window_counts, out=np.zeros_like(window_sums), where=window_counts > 0)
+
+
+def trend_frame(df, window=TREND_WINDOW, stride=TREND_STRIDE, max_points=TREND_MAX_POINTS):
+    """Rolling band means, calmness, stress and BPM over an EEG feature frame.
+
+    Calmness, stress and BPM are computed from each window's mean band
+    powers, so a window is scored like one long epoch. Returns a dict of
+    1-D arrays, one entry per window ("window_start", "window_end",
+    "<band>_mean", "calmness_score", "stress_score", "bpm"), plus the
+    "window" and "stride" that were used.
+    """
+    schema = get_schema(df.columns)
+    rel_features = [f"{band}_rel_power" for band in BANDS]
+    # One read of every needed column: (rows, channels, bands + [beta, gamma])
+    block = schema.select(df, rel_features + ["psd_beta", "psd_gamma"])
+    per_band = band_means(block[..., :len(BANDS)], axis=1)
+    power = np.nansum(block[..., len(BANDS):], axis=1)
+
+    starts, window, stride = window_starts(len(per_band), window, stride, max_points)
+    means = rolling_mean(per_band, starts, window)
+    beta_sum, gamma_sum = rolling_mean(power, starts, window).T
+
+    trend = {f"{band}_mean": means[:, i] for i, band in enumerate(BANDS)}
+    calmness = np.nan_to_num(calmness_from_bands(trend["alpha_mean"], trend["beta_mean"], trend["theta_mean"]))
+    trend["calmness_score"] = calmness
+    trend["stress_score"] = np.nan_to_num(stress_score(beta_sum, gamma_sum))
+    trend["bpm"] = np.round(np.nan_to_num(bpm_from_calmness(calmness)), 0)
+    trend["window_start"] = starts
+    trend["window_end"] = starts + window
+    trend["window"] = window
+    trend["stride"] = stride
+    return trend
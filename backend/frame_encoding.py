@@ -0,0 +1,60 @@
+import base64
+import os
+
+import cv2
+
+JPEG_QUALITY = int(os.environ.get("FRAME_JPEG_QUALITY", 75))
+MAX_FRAME_SIZE = int(os.environ.get("FRAME_MAX_SIZE", 1024))
+
+
+class FrameEncoder:
+    """Resize + JPEG-encode frames in a single OpenCV pass.
+
+    Frames go straight from the capture's BGR (or screen-grab BGRA) array to
+    `cv2.imencode`, without PIL round-trips. The resize and colour-conversion
+    targets are preallocated and reused while the frame size stays the same.
+    """
+
+    def __init__(self, max_size=MAX_FRAME_SIZE, quality=JPEG_QUALITY):
+        self.max_size = max_size
+        self.quality = quality
+        self._params = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
+        self._resize_buffers = {}
+        self._bgr_buffer = None
+
+    def _target_size(self, height, width):
+        scale = self.max_size / max(height, width)
+        if scale >= 1:
+            return None
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def _resize(self, frame):
+        size = self._target_size(*frame.shape[:2])
+        if size is None:
+            return frame
+        key = (size, frame.shape[2:])
+        buffer = self._resize_buffers.get(key)
+        if buffer is None:
+            buffer = self._resize_buffers[key] = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            return buffer
+        return cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_AREA)
+
+    def encode_bgr(self, frame):
+        """JPEG bytes for a BGR frame."""
+        ok, encoded = cv2.imencode(".jpg", self._resize(frame), self._params)
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        return encoded
+
+    def encode_bgra(self, frame):
+        """JPEG bytes for a BGRA frame (e.g. an mss screen grab viewed as an array)."""
+        resized = self._resize(frame)
+        if self._bgr_buffer is None or self._bgr_buffer.shape[:2] != resized.shape[:2]:
+            self._bgr_buffer = cv2.cvtColor(resized, cv2.COLOR_BGRA2BGR)
+        else:
+            cv2.cvtColor(resized, cv2.COLOR_BGRA2BGR, dst=self._bgr_buffer)
+        return self.encode_bgr(self._bgr_buffer)
+
+    @staticmethod
+    def to_message(encoded):
+        return {"mime_type": "image/jpeg", "data": base64.b64encode(encoded).decode()}
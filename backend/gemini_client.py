@@ -0,0 +1,68 @@
+import os
+import threading
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Keep-alive pool shared by every sync request made through a client
+MAX_CONNECTIONS = int(os.environ.get("GEMINI_MAX_CONNECTIONS", 20))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("GEMINI_MAX_KEEPALIVE_CONNECTIONS", 10))
+KEEPALIVE_EXPIRY = float(os.environ.get("GEMINI_KEEPALIVE_EXPIRY", 60))
+
+_clients = {}
+_lock = threading.Lock()
+_env_loaded = False
+
+
+def load_env():
+    """Read .env (cwd, then backend/) once per process instead of once per call."""
+    global _env_loaded
+    if not _env_loaded:
+        with _lock:
+            if not _env_loaded:
+                load_dotenv()
+                load_dotenv(Path(__file__).parent / ".env")
+                _env_loaded = True
+
+
+def get_api_key():
+    load_env()
+    return os.environ.get("GEMINI_API_KEY")
+
+
+def get_client(api_version=None):
+    """Process-wide genai.Client for `api_version`, built on first use.
+
+    Reusing one client keeps its HTTP connection pool (and TLS sessions)
+    alive across requests. Returns None when no API key is configured.
+    """
+    client = _clients.get(api_version)
+    if client is not None:
+        return client
+
+    api_key = get_api_key()
+    if not api_key:
+        return None
+
+    with _lock:
+        client = _clients.get(api_version)
+        if client is None:
+            import httpx
+            from google import genai
+            from google.genai import types
+
+            client = genai.Client(
+                api_key=api_key,
+                http_options=types.HttpOptions(
+                    api_version=api_version,
+                    client_args={
+                        "limits": httpx.Limits(
+                            max_connections=MAX_CONNECTIONS,
+                            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                            keepalive_expiry=KEEPALIVE_EXPIRY,
+                        ),
+                    },
+                ),
+            )
+            _clients[api_version] = client
+    return client
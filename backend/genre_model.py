@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+GENRE_LOG_PATH = os.environ.get("GENRE_LOG_PATH", str(Path(__file__).parent / "assets" / "genre_log.jsonl"))
+# Below this many logged answers the model abstains and the LLM is used
+GENRE_MODEL_MIN_SAMPLES = int(os.environ.get("GENRE_MODEL_MIN_SAMPLES", 20))
+GENRE_MODEL_MIN_CONFIDENCE = float(os.environ.get("GENRE_MODEL_MIN_CONFIDENCE", 0.8))
+# A changed log is re-read and refit at most this often (seconds), not after every answer
+GENRE_MODEL_REFIT_INTERVAL = float(os.environ.get("GENRE_MODEL_REFIT_INTERVAL", 60))
+
+_log_lock = threading.Lock()
+_model_lock = threading.Lock()
+_model = None
+_model_log_mtime = None
+_model_fit_at = None
+
+
+class GenreModel:
+    """k-nearest-neighbour genre lookup over standardized (bpm, calmness_score).
+
+    Fit from logged (bpm, wave_data) -> genre answers of the LLM. Confidence
+    is the distance-weighted vote share of the winning genre, scaled down
+    when the neighbours are far away relative to `radius`.
+    """
+
+    def __init__(self, k=7, radius=0.5):
+        self.k = k
+        self.radius = radius
+        self.features = np.empty((0, 2))
+        self.labels = np.empty(0, dtype=np.intp)
+        self.genres = []
+        self.mean = np.zeros(2)
+        self.scale = np.ones(2)
+
+    def fit(self, bpms, calmness_scores, genres):
+        raw = np.column_stack([np.asarray(bpms, dtype=np.float64), np.asarray(calmness_scores, dtype=np.float64)])
+        self.mean = raw.mean(axis=0) if len(raw) else np.zeros(2)
+        self.scale = raw.std(axis=0) if len(raw) else np.ones(2)
+        self.scale[self.scale == 0] = 1.0
+        self.features = (raw - self.mean) / self.scale
+
+        # Different casings of the same genre vote together; keep the first spelling seen
+        spelling = {}
+        for genre in genres:
+            spelling.setdefault(genre.strip().casefold(), genre.strip())
+        self.genres = list(spelling.values())
+        index = {key: i for i, key in enumerate(spelling)}
+        self.labels = np.array([index[genre.strip().casefold()] for genre in genres], dtype=np.intp)
+        return self
+
+    def __len__(self):
+        return len(self.labels)
+
+    def predict_batch(self, bpms, calmness_scores):
+        """Genre index and confidence for every query point, as two arrays."""
+        queries = np.column_stack([np.asarray(bpms, dtype=np.float64), np.asarray(calmness_scores, dtype=np.float64)])
+        queries = (queries - self.mean) / self.scale
+        if not len(self):
+            return np.full(len(queries), -1), np.zeros(len(queries))
+
+        k = min(self.k, len(self))
+        dist = np.linalg.norm(queries[:, None, :] - self.features[None, :, :], axis=2)
+        nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        near_dist = np.take_along_axis(dist, nearest, axis=1)
+        weights = 1.0 / (near_dist + 1e-3)
+
+        votes = np.zeros((len(queries), len(self.genres)))
+        np.add.at(votes, (np.arange(len(queries))[:, None], self.labels[nearest]), weights)
+        best = votes.argmax(axis=1)
+        share = votes[np.arange(len(queries)), best] / votes.sum(axis=1)
+        closeness = np.clip(self.radius / (near_dist.mean(axis=1) + 1e-9), 0.0, 1.0)
+        return best, share * closeness
+
+    def predict(self, bpm, calmness_score):
+        best, confidence = self.predict_batch([bpm], [calmness_score])
+        if best[0] < 0:
+            return None, 0.0
+        return self.genres[best[0]], float(confidence[0])
+
+
+def log_genre(bpm, wave_data, genre, path=None):
+    """Append an LLM genre answer to the training log."""
+    record = {"bpm": float(bpm), "calmness_score": float(wave_data["calmness_score"]), "genre": genre, "ts": time.time()}
+    with _log_lock:
+        with open(path or GENRE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def read_genre_log(path=None):
+    bpms, calmness_scores, genres = [], [], []
+    path = path or GENRE_LOG_PATH
+    if not os.path.exists(path):
+        return bpms, calmness_scores, genres
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                bpm, calm, genre = float(record["bpm"]), float(record["calmness_score"]), str(record["genre"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            if genre.strip():
+                bpms.append(bpm)
+                calmness_scores.append(calm)
+                genres.append(genre)
+    return bpms, calmness_scores, genres
+
+
+def get_genre_model():
+    """Model fit from the genre log. None if too few samples.
+
+    The log changes after every LLM answer; it is refit only when it changed
+    and the last fit is GENRE_MODEL_REFIT_INTERVAL seconds old.
+    """
+    global _model, _model_log_mtime, _model_fit_at
+    try:
+        mtime = os.stat(GENRE_LOG_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _model_lock:
+        now = time.monotonic()
+        due = _model_fit_at is None or now - _model_fit_at >= GENRE_MODEL_REFIT_INTERVAL
+        if mtime != _model_log_mtime and due:
+            bpms, calmness_scores, genres = read_genre_log()
+            _model = GenreModel().fit(bpms, calmness_scores, genres) if len(genres) >= GENRE_MODEL_MIN_SAMPLES else None
+            _model_log_mtime = mtime
+            _model_fit_at = now
+        return _model
+
+
+def predict_genre(bpm, wave_data, min_confidence=GENRE_MODEL_MIN_CONFIDENCE):
+    """Local genre if the model is confident enough, otherwise None."""
+    model = get_genre_model()
+    if model is None:
+        return None
+    genre, confidence = model.predict(bpm, wave_data["calmness_score"])
+    return genre if confidence >= min_confidence else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", default=GENRE_LOG_PATH, help="genre log to fit from")
+    args = parser.parse_args()
+
+    bpms, calmness_scores, genres = read_genre_log(args.log)
+    model = GenreModel().fit(bpms, calmness_scores, genres)
+    print(f"Fit on {len(model)} answers, {len(model.genres)} genres")
@@ -1,24 +1,24 @@
 import os
 import asyncio
-import base64
-import io
+import functools
+import threading
 import traceback
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+import time
 
-import cv2
-import pyaudio
-import PIL.Image
-import mss
+import numpy as np
 
 import argparse
 
-from google import genai
-from google.genai import types
+# cv2, pyaudio, mss and google.genai are imported where they are first
+# used, so importing this module (and main.py) stays cheap on servers that
+# never open a local device
+
+from backend.gemini_client import get_client
+from backend.voice_activity import VoiceActivityGate
+from backend.media_lanes import MediaLanes
+from backend.playback import BUFFER_SECONDS, BYTES_PER_SAMPLE, JITTER_TARGET_MS, PcmRingBuffer, PlaybackThread
 
-FORMAT = pyaudio.paInt16
 CHANNELS = 1
 SEND_SAMPLE_RATE = 16000
 RECEIVE_SAMPLE_RATE = 24000
@@ -28,40 +28,116 @@ MODEL = "models/gemini-2.5-flash-preview-native-audio-dialog"
 
 DEFAULT_MODE = "camera"
 
-client = genai.Client(
-    http_options={"api_version": "v1beta"},
-    api_key=os.environ.get("GEMINI_API_KEY"),
-)
+# "fixed" sends a frame every FRAME_INTERVAL; "adaptive" only on scene change
+DEFAULT_FRAME_SAMPLING = "fixed"
+FRAME_INTERVAL = 3.0
+# Adaptive mode: how often to look at the camera, the mean absolute
+# difference (0-255) of the downscaled grayscale frame that counts as a
+# change, and the longest gap between sent frames
+SAMPLE_INTERVAL = 0.5
+CHANGE_THRESHOLD = 8.0
+KEYFRAME_INTERVAL = 15.0
+CHANGE_DETECT_SIZE = (64, 48)
+
+LIVE_API_VERSION = "v1beta"
+
+_pya = None
+_pya_lock = threading.Lock()
+
+
+@functools.cache
+def get_config():
+    from google.genai import types
+
+    return types.LiveConnectConfig(
+        response_modalities=[
+            "AUDIO",
+        ],
+        media_resolution="MEDIA_RESOLUTION_MEDIUM",
+        speech_config=types.SpeechConfig(
+            voice_config=types.VoiceConfig(
+                prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name="Zephyr")
+            )
+        ),
+        context_window_compression=types.ContextWindowCompressionConfig(
+            trigger_tokens=8000,  # Lowered from 25600
+            sliding_window=types.SlidingWindow(target_tokens=4000),  # Lowered from 12800
+        ),
+    )
 
 
-CONFIG = types.LiveConnectConfig(
-    response_modalities=[
-        "AUDIO",
-    ],
-    media_resolution="MEDIA_RESOLUTION_MEDIUM",
-    speech_config=types.SpeechConfig(
-        voice_config=types.VoiceConfig(
-            prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name="Zephyr")
-        )
-    ),
-    context_window_compression=types.ContextWindowCompressionConfig(
-        trigger_tokens=8000,  # Lowered from 25600
-        sliding_window=types.SlidingWindow(target_tokens=4000),  # Lowered from 12800
-    ),
-)
+def get_pyaudio():
+    """Process-wide PyAudio instance, initialised (and devices probed) on first use."""
+    global _pya
+    if _pya is None:
+        with _pya_lock:
+            if _pya is None:
+                import pyaudio
+
+                _pya = pyaudio.PyAudio()
+    return _pya
+
+
+def __getattr__(name):
+    # Old module-level names, now built on first access
+    if name == "CONFIG":
+        return get_config()
+    if name == "pya":
+        return get_pyaudio()
+    if name == "FORMAT":
+        import pyaudio
 
-pya = pyaudio.PyAudio()
+        return pyaudio.paInt16
+    if name == "genai":
+        from google import genai
+
+        return genai
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class AudioLoop:
-    def __init__(self, video_mode=DEFAULT_MODE):
+    def __init__(
+        self,
+        video_mode=DEFAULT_MODE,
+        frame_sampling=DEFAULT_FRAME_SAMPLING,
+        change_threshold=CHANGE_THRESHOLD,
+        keyframe_interval=KEYFRAME_INTERVAL,
+        sample_interval=SAMPLE_INTERVAL,
+        jpeg_quality=None,
+        max_frame_size=None,
+        vad=True,
+        jitter_target_ms=JITTER_TARGET_MS,
+        source=None,
+    ):
         self.video_mode = video_mode
-        self.audio_in_queue = None
+        self.frame_sampling = frame_sampling
+        self.change_threshold = change_threshold
+        self.keyframe_interval = keyframe_interval
+        self.sample_interval = sample_interval
+        self.frames_sampled = 0
+        self.frames_sent = 0
+        self.jpeg_quality = jpeg_quality
+        self.max_frame_size = max_frame_size
+        self._encoder = None
+        # mss handles must stay on the thread that created them
+        self._screen_local = threading.local()
+        # None sends every mic chunk as-is
+        self.vad = VoiceActivityGate() if vad else None
+        self.jitter_target_ms = jitter_target_ms
+        # A MediaSource replaces the local mic/camera/speaker (e.g. a remote client or a file replay)
+        self.source = source
+        # Model audio is written here by receive_audio and drained by the playback thread
+        self.playback_buffer = None
+        if source is None:
+            self.playback_buffer = PcmRingBuffer(RECEIVE_SAMPLE_RATE * BYTES_PER_SAMPLE * BUFFER_SECONDS)
+        self.playback = None
         self.out_queue = None
         self.session = None
         self.send_text_task = None
         self.receive_audio_task = None
         self.play_audio_task = None
+        # Why run() ended early (e.g. no API key), for whoever owns this loop
+        self.error = None
         self._should_stop = False
 
     SYSTEM_PROMPT = (
@@ -70,6 +146,10 @@ class AudioLoop:
 
     def stop(self):
         self._should_stop = True
+        if self.vad:
+            print(f"Mic audio gating: {self.vad.stats()}")
+        if self.out_queue:
+            print(f"Realtime send lanes: {self.out_queue.stats()}")
         # Attempt to close audio stream if exists
         if hasattr(self, 'audio_stream') and self.audio_stream:
             try:
@@ -77,11 +157,12 @@ class AudioLoop:
             except Exception:
                 pass
         # Optionally, put None in queues to unblock
-        if self.audio_in_queue:
-            try:
-                self.audio_in_queue.put_nowait(None)
-            except Exception:
-                pass
+        if self.playback:
+            print(f"Playback: {self.playback.stats()}")
+            self.playback.stop()
+        if self.source:
+            print(f"Media source: {self.source.stats()}")
+            self.source.close()
         if self.out_queue:
             try:
                 self.out_queue.put_nowait(None)
@@ -100,55 +181,111 @@ class AudioLoop:
             prompt = f"{self.SYSTEM_PROMPT}\nUser: {text or '.'}"
             await self.session.send(input=prompt, end_of_turn=True)
 
-    def _get_frame(self, cap):
-        # Read the frameq
+    def _read_frame(self, cap):
         ret, frame = cap.read()
         # Check if the frame was read successfully
         if not ret:
             return None
-        # Fix: Convert BGR to RGB color space
-        # OpenCV captures in BGR but PIL expects RGB format
-        # This prevents the blue tint in the video feed
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = PIL.Image.fromarray(frame_rgb)  # Now using RGB frame
-        img.thumbnail([1024, 1024])
+        return frame
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            from backend.frame_encoding import FrameEncoder, JPEG_QUALITY, MAX_FRAME_SIZE
 
-        image_io = io.BytesIO()
-        img.save(image_io, format="jpeg")
-        image_io.seek(0)
+            self._encoder = FrameEncoder(
+                max_size=self.max_frame_size or MAX_FRAME_SIZE,
+                quality=self.jpeg_quality or JPEG_QUALITY,
+            )
+        return self._encoder
+
+    def _encode_frame(self, frame):
+        # OpenCV captures BGR, which is what imencode expects: no colour conversion
+        return self.encoder.to_message(self.encoder.encode_bgr(frame))
 
-        mime_type = "image/jpeg"
-        image_bytes = image_io.read()
-        return {"mime_type": mime_type, "data": base64.b64encode(image_bytes).decode()}
+    def _get_frame(self, cap):
+        frame = self._read_frame(cap)
+        if frame is None:
+            return None
+        return self._encode_frame(frame)
+
+    @staticmethod
+    def _change_signature(frame):
+        """Tiny grayscale thumbnail used to compare frames cheaply."""
+        import cv2
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, CHANGE_DETECT_SIZE, interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def _change_score(signature, previous):
+        if previous is None:
+            return float("inf")
+        import cv2
+
+        return float(np.mean(cv2.absdiff(signature, previous)))
+
+    def _sample_frame(self, cap, previous, last_sent_at):
+        """Read a frame and encode it only if the scene changed or a keyframe is due.
+
+        Returns (encoded frame or None, signature, read ok).
+        """
+        frame = self._read_frame(cap)
+        if frame is None:
+            return None, previous, False
+        self.frames_sampled += 1
+        signature = self._change_signature(frame)
+        changed = self._change_score(signature, previous) >= self.change_threshold
+        keyframe_due = time.monotonic() - last_sent_at >= self.keyframe_interval
+        if not (changed or keyframe_due):
+            return None, previous, True
+        # Compare later frames against the one actually sent
+        return self._encode_frame(frame), signature, True
 
     async def get_frames(self):
+        import cv2
+
         cap = await asyncio.to_thread(
             cv2.VideoCapture, 0
         )
+        if self.frame_sampling == "adaptive":
+            await self._get_frames_adaptive(cap)
+        else:
+            while not self._should_stop:
+                frame = await asyncio.to_thread(self._get_frame, cap)
+                if frame is None or self._should_stop:
+                    break
+                await asyncio.sleep(FRAME_INTERVAL)
+                self.frames_sampled += 1
+                self.frames_sent += 1
+                await self.out_queue.put(frame)
+        cap.release()
+
+    async def _get_frames_adaptive(self, cap):
+        previous = None
+        last_sent_at = float("-inf")
         while not self._should_stop:
-            frame = await asyncio.to_thread(self._get_frame, cap)
-            if frame is None or self._should_stop:
+            frame, previous, ok = await asyncio.to_thread(self._sample_frame, cap, previous, last_sent_at)
+            if not ok or self._should_stop:
                 break
-            await asyncio.sleep(3.0)
-            await self.out_queue.put(frame)
-        cap.release()
+            if frame is not None:
+                last_sent_at = time.monotonic()
+                self.frames_sent += 1
+                await self.out_queue.put(frame)
+            await asyncio.sleep(self.sample_interval)
 
     def _get_screen(self):
-        sct = mss.mss()
+        sct = getattr(self._screen_local, "sct", None)
+        if sct is None:
+            import mss
+
+            sct = self._screen_local.sct = mss.mss()
         monitor = sct.monitors[0]
 
         i = sct.grab(monitor)
 
-        mime_type = "image/jpeg"
-        image_bytes = mss.tools.to_png(i.rgb, i.size)
-        img = PIL.Image.open(io.BytesIO(image_bytes))
-
-        image_io = io.BytesIO()
-        img.save(image_io, format="jpeg")
-        image_io.seek(0)
-
-        image_bytes = image_io.read()
-        return {"mime_type": mime_type, "data": base64.b64encode(image_bytes).decode()}
+        # The grab's raw BGRA buffer viewed as an array, no PNG round-trip
+        return self.encoder.to_message(self.encoder.encode_bgra(np.asarray(i)))
 
     async def get_screen(self):
         while not self._should_stop:
@@ -170,10 +307,11 @@ class AudioLoop:
                 await self.session.send(input=prompt)
 
     async def listen_audio(self):
+        pya = await asyncio.to_thread(get_pyaudio)
         mic_info = pya.get_default_input_device_info()
         self.audio_stream = await asyncio.to_thread(
             pya.open,
-            format=FORMAT,
+            format=pya.get_format_from_width(BYTES_PER_SAMPLE),
             channels=CHANNELS,
             rate=SEND_SAMPLE_RATE,
             input=True,
@@ -184,65 +322,137 @@ class AudioLoop:
             kwargs = {"exception_on_overflow": False}
         else:
             kwargs = {}
+        try:
+            while not self._should_stop:
+                data = await asyncio.to_thread(self.audio_stream.read, CHUNK_SIZE, **kwargs)
+                if self._should_stop:
+                    break
+                await self._send_audio(data)
+        finally:
+            await self._flush_audio()
+
+    async def _send_audio(self, data):
+        frames = self.vad.feed(data) if self.vad else [data]
+        for frame in frames:
+            await self.out_queue.put({"data": frame, "mime_type": "audio/pcm"})
+
+    async def _flush_audio(self):
+        """Send the end of the last utterance, still held by the VAD gate.
+
+        Sent directly: send_realtime stops reading out_queue once the loop is stopping.
+        """
+        if not self.vad or self.session is None:
+            return
+        for frame in self.vad.flush():
+            try:
+                await self.session.send(input={"data": frame, "mime_type": "audio/pcm"})
+            except Exception as e:
+                print(f"Could not send final mic audio: {e}")
+                return
+
+    async def send_source_text(self):
         while not self._should_stop:
-            data = await asyncio.to_thread(self.audio_stream.read, CHUNK_SIZE, **kwargs)
-            if self._should_stop:
+            text = await self.source.read_text()
+            if text is None or self._should_stop:
+                break
+            prompt = f"{self.SYSTEM_PROMPT}\nUser: {text or '.'}"
+            await self.session.send(input=prompt, end_of_turn=True)
+
+    async def listen_source_audio(self):
+        try:
+            while not self._should_stop:
+                data = await self.source.read_audio()
+                if data is None or self._should_stop:
+                    break
+                await self._send_audio(data)
+        finally:
+            await self._flush_audio()
+
+    async def get_source_frames(self):
+        while not self._should_stop:
+            frame = await self.source.read_frame()
+            if frame is None or self._should_stop:
                 break
-            await self.out_queue.put({"data": data, "mime_type": "audio/pcm"})
+            self.frames_sampled += 1
+            self.frames_sent += 1
+            await self.out_queue.put(frame)
 
     async def receive_audio(self):
-        "Background task to reads from the websocket and write pcm chunks to the output queue"
+        "Background task to reads from the websocket and write pcm chunks to the playback buffer"
         while not self._should_stop:
             turn = self.session.receive()
             async for response in turn:
                 if self._should_stop:
                     break
+                server_content = response.server_content
+                if server_content and server_content.interrupted:
+                    # The user talked over the model: drop what has not been played yet
+                    if self.source:
+                        self.source.interrupt()
+                    else:
+                        self.playback_buffer.clear()
                 if data := response.data:
-                    self.audio_in_queue.put_nowait(data)
+                    if self.source:
+                        self.source.play(data)
+                    else:
+                        self.playback_buffer.write(data)
                     continue
                 if text := response.text:
                     print(text, end="")
 
-            while not self.audio_in_queue.empty():
-                self.audio_in_queue.get_nowait()
             if self._should_stop:
                 break
 
     async def play_audio(self):
+        pya = await asyncio.to_thread(get_pyaudio)
         stream = await asyncio.to_thread(
             pya.open,
-            format=FORMAT,
+            format=pya.get_format_from_width(BYTES_PER_SAMPLE),
             channels=CHANNELS,
             rate=RECEIVE_SAMPLE_RATE,
             output=True,
         )
-        while not self._should_stop:
-            bytestream = await self.audio_in_queue.get()
-            if bytestream is None or self._should_stop:
-                break
-            await asyncio.to_thread(stream.write, bytestream)
+        # Blocking writes happen on one dedicated thread instead of an executor hop per chunk
+        self.playback = PlaybackThread(
+            stream,
+            self.playback_buffer,
+            RECEIVE_SAMPLE_RATE,
+            jitter_target_ms=self.jitter_target_ms,
+        )
+        self.playback.start()
 
     async def run(self):
         try:
+            client = get_client(LIVE_API_VERSION)
+            if client is None:
+                self.error = "No Gemini API key provided"
+                print(f"Live session not started: {self.error}")
+                return
             async with (
-                client.aio.live.connect(model=MODEL, config=CONFIG) as session,
+                client.aio.live.connect(model=MODEL, config=get_config()) as session,
                 asyncio.TaskGroup() as tg,
             ):
                 self.session = session
 
-                self.audio_in_queue = asyncio.Queue()
-                self.out_queue = asyncio.Queue(maxsize=5)
+                # Separate lanes so a large video frame never holds up mic audio
+                self.out_queue = MediaLanes()
 
-                send_text_task = tg.create_task(self.send_text())
                 tg.create_task(self.send_realtime())
-                tg.create_task(self.listen_audio())
-                if self.video_mode == "camera":
-                    tg.create_task(self.get_frames())
-                elif self.video_mode == "screen":
-                    tg.create_task(self.get_screen())
-
                 tg.create_task(self.receive_audio())
-                tg.create_task(self.play_audio())
+                if self.source is not None:
+                    # Headless: no local devices are touched
+                    send_text_task = tg.create_task(self.send_source_text())
+                    tg.create_task(self.listen_source_audio())
+                    if self.source.has_video:
+                        tg.create_task(self.get_source_frames())
+                else:
+                    send_text_task = tg.create_task(self.send_text())
+                    tg.create_task(self.listen_audio())
+                    if self.video_mode == "camera":
+                        tg.create_task(self.get_frames())
+                    elif self.video_mode == "screen":
+                        tg.create_task(self.get_screen())
+                    tg.create_task(self.play_audio())
 
                 await send_text_task
                 raise asyncio.CancelledError("User requested exit")
@@ -250,8 +460,19 @@ class AudioLoop:
         except asyncio.CancelledError:
             pass
         except ExceptionGroup as EG:
-            self.audio_stream.close()
+            self.error = "; ".join(str(e) for e in EG.exceptions) or str(EG)
+            if getattr(self, "audio_stream", None):
+                self.audio_stream.close()
             traceback.print_exception(EG)
+        except Exception as e:
+            # e.g. the Live API refused the connection
+            self.error = str(e)
+            traceback.print_exception(e)
+        finally:
+            if self.playback:
+                self.playback.stop()
+            if self.source:
+                self.source.close()
 
 
 if __name__ == "__main__":
@@ -263,6 +484,39 @@ if __name__ == "__main__":
         help="pixels to stream from",
         choices=["camera", "screen", "none"],
     )
+    parser.add_argument(
+        "--frame-sampling",
+        type=str,
+        default=DEFAULT_FRAME_SAMPLING,
+        help="send camera frames on a fixed interval or only when the scene changes",
+        choices=["fixed", "adaptive"],
+    )
+    parser.add_argument(
+        "--no-vad",
+        action="store_true",
+        help="send every mic chunk, including silence",
+    )
+    parser.add_argument("--replay-audio", help="16 kHz mono WAV to replay instead of the mic (load testing)")
+    parser.add_argument("--replay-video", help="video file to replay alongside --replay-audio")
+    parser.add_argument("--prompt", action="append", help="text prompt sent at the start of a replay")
+    parser.add_argument("--sessions", type=int, default=1, help="concurrent replay sessions")
     args = parser.parse_args()
-    main = AudioLoop(video_mode=args.mode)
-    asyncio.run(main.run())
\ No newline at end of file
+    if args.replay_audio:
+        from backend.media_sources import FileReplaySource
+
+        async def replay():
+            loops = [
+                AudioLoop(
+                    vad=not args.no_vad,
+                    source=FileReplaySource(args.replay_audio, args.replay_video, prompts=args.prompt or ()),
+                )
+                for _ in range(args.sessions)
+            ]
+            await asyncio.gather(*(loop.run() for loop in loops))
+            for i, loop in enumerate(loops):
+                print(f"session {i}: {loop.source.stats()} vad={loop.vad.stats() if loop.vad else None}")
+
+        asyncio.run(replay())
+    else:
+        main = AudioLoop(video_mode=args.mode, frame_sampling=args.frame_sampling, vad=not args.no_vad)
+        asyncio.run(main.run())
\ No newline at end of file
@@ -0,0 +1,112 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# put() sweeps expired entries (memory and SQLite) at most this often
+PURGE_INTERVAL = 300
+
+
+class SemanticCache:
+    """TTL + LRU cache for LLM answers keyed on quantized BPM / calmness.
+
+    Nearby inputs land in the same bucket (`bpm_bin` BPM wide, `calmness_bin`
+    calmness wide) and share one answer. With `db_path` set, entries are also
+    written to SQLite so they survive restarts and are shared between workers.
+    """
+
+    def __init__(self, bpm_bin=5.0, calmness_bin=0.1, ttl=3600.0, max_entries=1024, db_path=None):
+        self.bpm_bin = bpm_bin
+        self.calmness_bin = calmness_bin
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = time.time()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            bpm_bin=float(os.environ.get("LLM_CACHE_BPM_BIN", 5)),
+            calmness_bin=float(os.environ.get("LLM_CACHE_CALMNESS_BIN", 0.1)),
+            ttl=float(os.environ.get("LLM_CACHE_TTL", 3600)),
+            max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 1024)),
+            db_path=os.environ.get("LLM_CACHE_DB") or None,
+        )
+
+    def key(self, kind, bpm, calmness_score=None, *extra):
+        """Cache key for `kind` with BPM/calmness snapped to their bins."""
+        parts = [kind, f"bpm={math.floor(float(bpm) / self.bpm_bin)}"]
+        if calmness_score is not None:
+            parts.append(f"calm={math.floor(float(calmness_score) / self.calmness_bin)}")
+        parts.extend(str(value).strip().lower() for value in extra)
+        return "|".join(parts)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+                if row is not None:
+                    self._db.execute("DELETE FROM llm_cache WHERE key = ? AND expires_at <= ?", (key, now))
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            if now - self._last_purge >= PURGE_INTERVAL:
+                self._purge(now)
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+
+    def _remember(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _purge(self, now):
+        self._last_purge = now
+        for key in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+        if self._db is not None:
+            self._db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+
+    def purge_expired(self):
+        with self._lock:
+            self._purge(time.time())
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# Shared by recommend_genre and recommend_song
+response_cache = SemanticCache.from_env()
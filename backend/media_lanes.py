@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections import deque
+
+# Mic frames buffered before the oldest is dropped (~2 s of batched speech)
+AUDIO_LANE_SIZE = 32
+# Items that waited longer than this before being sent count as delayed
+DELAY_THRESHOLD = 0.25
+
+
+class Lane:
+    def __init__(self, name, maxlen):
+        self.name = name
+        self.items = deque(maxlen=maxlen)
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.delayed = 0
+        self.max_wait = 0.0
+
+    def push(self, item):
+        if self.items.maxlen is not None and len(self.items) == self.items.maxlen:
+            self.dropped += 1
+        self.items.append((time.monotonic(), item))
+        self.enqueued += 1
+
+    def pop(self, delay_threshold):
+        queued_at, item = self.items.popleft()
+        wait = time.monotonic() - queued_at
+        self.sent += 1
+        self.max_wait = max(self.max_wait, wait)
+        if wait > delay_threshold:
+            self.delayed += 1
+        return item
+
+    def stats(self):
+        return {
+            "queued": len(self.items),
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "delayed": self.delayed,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+        }
+
+
+class MediaLanes:
+    """Outgoing realtime queue with one lane per kind of message.
+
+    Drop-in for the single asyncio.Queue AudioLoop used to share: put()
+    never blocks, so producers are never stalled by the network. get()
+    serves control messages (text, the None stop sentinel) first, then
+    mic audio from a bounded FIFO that drops its oldest frame when full,
+    then video, which only ever keeps the newest frame.
+    """
+
+    def __init__(self, audio_size=AUDIO_LANE_SIZE, delay_threshold=DELAY_THRESHOLD):
+        self.delay_threshold = delay_threshold
+        self.control = Lane("control", None)
+        self.audio = Lane("audio", audio_size)
+        self.video = Lane("video", 1)
+        self._lanes = (self.control, self.audio, self.video)
+        self._ready = asyncio.Event()
+
+    def _lane_for(self, item):
+        if isinstance(item, dict):
+            mime_type = item.get("mime_type", "")
+            if mime_type.startswith("audio/"):
+                return self.audio
+            if mime_type.startswith("image/"):
+                return self.video
+        return self.control
+
+    def put_nowait(self, item):
+        self._lane_for(item).push(item)
+        self._ready.set()
+
+    async def put(self, item):
+        self.put_nowait(item)
+
+    def empty(self):
+        return not any(lane.items for lane in self._lanes)
+
+    def get_nowait(self):
+        for lane in self._lanes:
+            if lane.items:
+                return lane.pop(self.delay_threshold)
+        raise asyncio.QueueEmpty
+
+    async def get(self):
+        while self.empty():
+            self._ready.clear()
+            await self._ready.wait()
+        return self.get_nowait()
+
+    def stats(self):
+        return {lane.name: lane.stats() for lane in self._lanes}
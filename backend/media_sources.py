@@ -0,0 +1,277 @@
+import asyncio
+import time
+import wave
+from collections import deque
+
+# Audio the Live API expects from us: 16 kHz mono int16 PCM
+SEND_SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+CHUNK_SIZE = 1024
+# Queued client audio chunks before the oldest is dropped (~4 s)
+MAX_QUEUED_AUDIO = 64
+# Queued model audio messages waiting to be sent to a remote client
+MAX_QUEUED_OUTPUT = 256
+
+
+class MediaSource:
+    """Where an AudioLoop gets its input from and sends the model's audio to.
+
+    The local mic/camera/speaker path lives in AudioLoop itself; subclasses
+    of this replace it for sessions that have no devices attached. Every
+    read returns None once the source is exhausted or closed.
+    """
+
+    has_video = False
+
+    async def read_audio(self):
+        """Next chunk of 16 kHz mono int16 PCM."""
+        return None
+
+    async def read_frame(self):
+        """Next realtime image message ({"mime_type", "data": base64})."""
+        return None
+
+    async def read_text(self):
+        """Next text prompt; None ends the session."""
+        return None
+
+    def play(self, data):
+        """24 kHz PCM produced by the model."""
+
+    def interrupt(self):
+        """The model was interrupted: drop audio not yet played."""
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+def _push_bounded(queue, item):
+    """put_nowait that drops the oldest item instead of raising when full."""
+    dropped = 0
+    while True:
+        try:
+            queue.put_nowait(item)
+            return dropped
+        except asyncio.QueueFull:
+            queue.get_nowait()
+            dropped += 1
+
+
+class QueueSource(MediaSource):
+    """Media pushed in by a client over a WebSocket.
+
+    push_*() and next_output() must run on the same event loop as the
+    AudioLoop reading from it. Audio is a bounded FIFO that drops its
+    oldest chunk, video keeps only the newest frame, and model audio for
+    the client is queued the same way.
+    """
+
+    has_video = True
+
+    def __init__(self, max_audio=MAX_QUEUED_AUDIO, max_output=MAX_QUEUED_OUTPUT):
+        self._audio = asyncio.Queue(maxsize=max_audio)
+        self._text = asyncio.Queue()
+        self._output = asyncio.Queue(maxsize=max_output)
+        self._frame = None
+        self._frame_ready = asyncio.Event()
+        self.closed = False
+        self.audio_dropped = 0
+        self.frames_dropped = 0
+        self.output_dropped = 0
+
+    def push_audio(self, data):
+        if not self.closed:
+            self.audio_dropped += _push_bounded(self._audio, data)
+
+    def push_frame(self, message):
+        if self.closed:
+            return
+        if self._frame is not None:
+            self.frames_dropped += 1
+        self._frame = message
+        self._frame_ready.set()
+
+    def push_text(self, text):
+        if not self.closed:
+            self._text.put_nowait(text)
+
+    async def read_audio(self):
+        if self.closed and self._audio.empty():
+            return None
+        return await self._audio.get()
+
+    async def read_frame(self):
+        while self._frame is None and not self.closed:
+            self._frame_ready.clear()
+            await self._frame_ready.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+    async def read_text(self):
+        if self.closed and self._text.empty():
+            return None
+        return await self._text.get()
+
+    def play(self, data):
+        self.output_dropped += _push_bounded(self._output, data)
+
+    def interrupt(self):
+        while not self._output.empty():
+            self._output.get_nowait()
+        _push_bounded(self._output, {"type": "interrupted"})
+
+    async def next_output(self):
+        """Model audio (bytes) or a control message (dict) for the client; None once closed."""
+        return await self._output.get()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # Wake every reader so the AudioLoop tasks can finish
+        _push_bounded(self._audio, None)
+        self._text.put_nowait(None)
+        self._frame_ready.set()
+        _push_bounded(self._output, None)
+
+    def stats(self):
+        return {
+            "audio_queued": self._audio.qsize(),
+            "audio_dropped": self.audio_dropped,
+            "frames_dropped": self.frames_dropped,
+            "output_dropped": self.output_dropped,
+        }
+
+
+class FileReplaySource(MediaSource):
+    """Replays a recorded WAV (and optionally a video file) as a live user, for load tests.
+
+    Audio is paced at real time unless `realtime` is False, video frames are
+    sampled every `frame_interval` seconds of replay time, and the session
+    ends when the audio does (or loops forever with `loop=True`). Model
+    audio is only counted.
+    """
+
+    def __init__(
+        self,
+        audio_path,
+        video_path=None,
+        prompts=(),
+        realtime=True,
+        loop=False,
+        frame_interval=3.0,
+        chunk_size=CHUNK_SIZE,
+    ):
+        self.audio_path = audio_path
+        self.video_path = video_path
+        self.has_video = video_path is not None
+        self.realtime = realtime
+        self.loop = loop
+        self.frame_interval = frame_interval
+        self.chunk_size = chunk_size
+        self._prompts = deque(prompts)
+        self._wav = self._open_wav(audio_path)
+        self._capture = None
+        self._encoder = None
+        self._video_seconds = None
+        self._started_at = None
+        self._sent_seconds = 0.0
+        self._next_frame_at = 0.0
+        self._done = asyncio.Event()
+        self.audio_bytes = 0
+        self.frames = 0
+        self.model_audio_bytes = 0
+        self.interruptions = 0
+        self.first_reply_latency = None
+
+    @staticmethod
+    def _open_wav(path):
+        wav = wave.open(path, "rb")
+        if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) != (SEND_SAMPLE_RATE, 1, SAMPLE_WIDTH):
+            wav.close()
+            raise ValueError(f"{path}: expected {SEND_SAMPLE_RATE} Hz mono 16-bit PCM")
+        return wav
+
+    async def _pace(self, seconds):
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        if self.realtime:
+            delay = self._started_at + seconds - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def read_audio(self):
+        if self._done.is_set():
+            return None
+        data = self._wav.readframes(self.chunk_size)
+        if not data and self.loop:
+            self._wav.rewind()
+            data = self._wav.readframes(self.chunk_size)
+        if not data:
+            self._done.set()
+            return None
+        await self._pace(self._sent_seconds)
+        self._sent_seconds += len(data) / (SEND_SAMPLE_RATE * SAMPLE_WIDTH)
+        self.audio_bytes += len(data)
+        return data
+
+    def _grab_frame(self, position):
+        import cv2
+
+        from backend.frame_encoding import FrameEncoder
+
+        if self._capture is None:
+            self._capture = cv2.VideoCapture(self.video_path)
+            self._encoder = FrameEncoder()
+            fps = self._capture.get(cv2.CAP_PROP_FPS) or 0
+            frames = self._capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+            self._video_seconds = frames / fps if fps and frames else None
+        if self.loop and self._video_seconds:
+            position %= self._video_seconds
+        self._capture.set(cv2.CAP_PROP_POS_MSEC, position * 1000)
+        ok, frame = self._capture.read()
+        if not ok:
+            return None
+        return self._encoder.to_message(self._encoder.encode_bgr(frame))
+
+    async def read_frame(self):
+        if not self.has_video or self._done.is_set():
+            return None
+        await self._pace(self._next_frame_at)
+        message = await asyncio.to_thread(self._grab_frame, self._next_frame_at)
+        self._next_frame_at += self.frame_interval
+        if message is not None:
+            self.frames += 1
+        return message
+
+    async def read_text(self):
+        if self._prompts:
+            return self._prompts.popleft()
+        await self._done.wait()
+        return None
+
+    def play(self, data):
+        if self.first_reply_latency is None and self._started_at is not None:
+            self.first_reply_latency = time.monotonic() - self._started_at
+        self.model_audio_bytes += len(data)
+
+    def interrupt(self):
+        self.interruptions += 1
+
+    def close(self):
+        self._done.set()
+        self._wav.close()
+        if self._capture is not None:
+            self._capture.release()
+
+    def stats(self):
+        return {
+            "audio_bytes": self.audio_bytes,
+            "frames": self.frames,
+            "model_audio_bytes": self.model_audio_bytes,
+            "interruptions": self.interruptions,
+            "first_reply_latency": self.first_reply_latency,
+        }
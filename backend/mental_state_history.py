@@ -0,0 +1,178 @@
+import bisect
+import datetime
+import os
+from collections import Counter
+
+HISTORY_CAPACITY = int(os.environ.get("MENTAL_STATE_HISTORY_CAPACITY", 5000))
+
+
+def to_epoch(value):
+    """Epoch seconds from a float, numeric string or ISO-8601 timestamp (None passes through)."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+class _Ring:
+    """Fixed-capacity circular array: O(1) indexing, append and popleft.
+
+    Unlike a deque, random access is O(1) everywhere, so bisect over it is
+    really O(log n) and a slice of k items costs O(k).
+    """
+
+    def __init__(self, capacity):
+        self._items = [None] * capacity
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError(i)
+        return self._items[(self._head + i) % len(self._items)]
+
+    def append(self, item):
+        """Add `item` at the end; returns the evicted oldest item when full, else None."""
+        capacity = len(self._items)
+        evicted = None
+        if self._size == capacity:
+            evicted = self.popleft()
+        self._items[(self._head + self._size) % capacity] = item
+        self._size += 1
+        return evicted
+
+    def popleft(self):
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % len(self._items)
+        self._size -= 1
+        return item
+
+    def slice(self, start, end):
+        """Items [start, end) as a list."""
+        capacity = len(self._items)
+        first = (self._head + start) % capacity
+        count = max(0, end - start)
+        if first + count <= capacity:
+            return self._items[first:first + count]
+        return self._items[first:] + self._items[:first + count - capacity]
+
+
+def _minute(timestamp):
+    return int(timestamp // 60) * 60
+
+
+class MentalStateHistory:
+    """Fixed-capacity ring buffer of mental states, oldest dropped first.
+
+    Entries are kept in arrival order next to their epoch timestamp, so time
+    ranges are found by bisection instead of scanning the whole buffer.
+    Per-minute summaries are kept up to date on every append and eviction.
+    """
+
+    def __init__(self, capacity=HISTORY_CAPACITY):
+        self.capacity = capacity
+        self._times = _Ring(capacity)
+        self._states = _Ring(capacity)
+        # Running per-minute buckets, oldest minute first
+        self._minutes = _Ring(capacity)
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._states)
+
+    def append(self, state, timestamp=None):
+        timestamp = to_epoch(timestamp if timestamp is not None else state.get("timestamp"))
+        # Keep the buffer sorted even if the wall clock steps backwards
+        if self._times and timestamp < self._times[-1]:
+            timestamp = self._times[-1]
+        evicted_time = self._times.append(timestamp)
+        evicted_state = self._states.append(state)
+        if evicted_state is not None:
+            self._count(evicted_time, evicted_state, -1)
+        self._count(timestamp, state, 1)
+
+    def _count(self, timestamp, state, sign):
+        minute = _minute(timestamp)
+        bucket = self._buckets.get(minute)
+        if bucket is None:
+            bucket = self._buckets[minute] = {"count": 0, "confidence": 0.0, "types": Counter()}
+            self._minutes.append(minute)
+        state_type = state.get("type", "Unknown")
+        bucket["count"] += sign
+        bucket["confidence"] += sign * float(state.get("confidence", 0) or 0)
+        bucket["types"][state_type] += sign
+        if not bucket["types"][state_type]:
+            del bucket["types"][state_type]
+        if not bucket["count"]:
+            # Only the oldest minute ever empties: entries leave oldest first
+            del self._buckets[minute]
+            self._minutes.popleft()
+
+    def latest(self):
+        return self._states[-1] if self._states else None
+
+    def _range(self, since=None, until=None):
+        lo = 0 if since is None else bisect.bisect_left(self._times, to_epoch(since))
+        hi = len(self._times) if until is None else bisect.bisect_right(self._times, to_epoch(until))
+        return lo, max(lo, hi)
+
+    def query(self, since=None, until=None, limit=100, offset=0):
+        """Page of states in [since, until], oldest first.
+
+        Pages count back from the newest entry: offset=0 is the latest
+        `limit` states, offset=limit the ones before them. Returns
+        (states, total matching).
+        """
+        lo, hi = self._range(since, until)
+        total = hi - lo
+        end = max(lo, hi - offset)
+        start = lo if limit is None else max(lo, end - limit)
+        return self._states.slice(start, end), total
+
+    def _partial_bucket(self, minute, lo, hi):
+        """Bucket of `minute` counting only entries [lo, hi) (a range cut mid-minute)."""
+        start = max(lo, bisect.bisect_left(self._times, minute))
+        end = min(hi, bisect.bisect_left(self._times, minute + 60))
+        bucket = {"count": 0, "confidence": 0.0, "types": Counter()}
+        for state in self._states.slice(start, end):
+            bucket["count"] += 1
+            bucket["confidence"] += float(state.get("confidence", 0) or 0)
+            bucket["types"][state.get("type", "Unknown")] += 1
+        return bucket
+
+    def per_minute(self, since=None, until=None):
+        """Per-minute counts, mean confidence and dominant type over [since, until].
+
+        Whole minutes come from the running buckets; only the first and last
+        minute are recounted when the range cuts through them.
+        """
+        lo, hi = self._range(since, until)
+        if lo == hi:
+            return []
+        first, last = _minute(self._times[lo]), _minute(self._times[hi - 1])
+        first_cut = lo > 0 and _minute(self._times[lo - 1]) == first
+        last_cut = hi < len(self._times) and _minute(self._times[hi]) == last
+        summary = []
+        start = bisect.bisect_left(self._minutes, first)
+        end = bisect.bisect_right(self._minutes, last)
+        for minute in self._minutes.slice(start, end):
+            if (minute == first and first_cut) or (minute == last and last_cut):
+                bucket = self._partial_bucket(minute, lo, hi)
+            else:
+                bucket = self._buckets[minute]
+            summary.append({
+                "minute": datetime.datetime.fromtimestamp(minute).isoformat(),
+                "count": bucket["count"],
+                "avgConfidence": round(bucket["confidence"] / bucket["count"], 1),
+                "dominantType": bucket["types"].most_common(1)[0][0],
+                "types": dict(bucket["types"]),
+            })
+        return summary
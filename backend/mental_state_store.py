@@ -0,0 +1,276 @@
+import contextlib
+import datetime
+import os
+import queue
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialised
+    fcntl = None
+
+from backend.mental_state_history import HISTORY_CAPACITY
+
+MENTAL_STATE_TYPES = ("Unknown", "Relaxed", "Focused", "Creative", "Balanced", "Distressed")
+_TYPE_CODES = {name: code for code, name in enumerate(MENTAL_STATE_TYPES)}
+
+FILE_MAGIC = b"MSL1"
+# session id length, type enum, confidence, timestamp (us since epoch), description length
+RECORD = struct.Struct("<HBBqH")
+MAX_TEXT = 0xFFFF
+
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 0.5
+# Compaction keeps the most recently written sessions, and no more states each than a history holds
+MAX_SESSIONS = 256
+MAX_STATES = HISTORY_CAPACITY
+# A log is compacted once it outgrows twice its last compacted size, and at least this
+COMPACT_MIN_BYTES = int(os.environ.get("MENTAL_STATE_LOG_COMPACT_BYTES", 16 * 1024 * 1024))
+
+
+def encode_record(session_id, state):
+    session_bytes = str(session_id).encode("utf-8")[:MAX_TEXT]
+    description = str(state.get("description", "")).encode("utf-8")[:MAX_TEXT]
+    try:
+        confidence = int(round(float(state.get("confidence", 0))))
+    except (TypeError, ValueError):
+        confidence = 0
+    timestamp = state.get("timestamp")
+    if isinstance(timestamp, str):
+        timestamp = datetime.datetime.fromisoformat(timestamp).timestamp()
+    micros = int(round(float(timestamp if timestamp is not None else 0) * 1_000_000))
+    return RECORD.pack(
+        len(session_bytes),
+        _TYPE_CODES.get(state.get("type"), 0),
+        min(max(confidence, 0), 255),
+        micros,
+        len(description),
+    ) + session_bytes + description
+
+
+def split_records(data):
+    """Split an encoded log body into [(session_id, raw record)] and the length of its valid prefix.
+
+    Splitting stops at a torn trailing record, e.g. one cut short by a crash.
+    """
+    records = []
+    offset = 0
+    end = len(data)
+    while offset + RECORD.size <= end:
+        session_len, _, _, _, text_len = RECORD.unpack_from(data, offset)
+        body = offset + RECORD.size
+        if body + session_len + text_len > end:
+            break
+        session_id = bytes(data[body:body + session_len]).decode("utf-8", errors="replace")
+        records.append((session_id, data[offset:body + session_len + text_len]))
+        offset = body + session_len + text_len
+    return records, offset
+
+
+def decode_record(raw):
+    session_len, type_code, confidence, micros, text_len = RECORD.unpack_from(raw)
+    description = bytes(raw[RECORD.size + session_len:RECORD.size + session_len + text_len])
+    return {
+        "type": MENTAL_STATE_TYPES[type_code] if type_code < len(MENTAL_STATE_TYPES) else "Unknown",
+        "confidence": confidence,
+        "description": description.decode("utf-8", errors="ignore"),
+        "timestamp": datetime.datetime.fromtimestamp(micros / 1_000_000).isoformat(),
+    }
+
+
+def decode_records(data):
+    """Decode an encoded log body into [(session_id, state)] and the length of its valid prefix."""
+    records, valid = split_records(data)
+    return [(session_id, decode_record(raw)) for session_id, raw in records], valid
+
+
+def compact_records(records, max_sessions=MAX_SESSIONS, max_states=MAX_STATES):
+    """The raw records of the `max_sessions` most recently written sessions, `max_states` each.
+
+    Write order is kept, so replaying the result rebuilds the same archive.
+    """
+    last_write = {}
+    counts = {}
+    for index, (session_id, _) in enumerate(records):
+        last_write[session_id] = index
+        counts[session_id] = counts.get(session_id, 0) + 1
+    kept = set(sorted(last_write, key=last_write.get)[-max_sessions:]) if max_sessions > 0 else set()
+    # Skip each kept session's oldest states beyond max_states
+    skip = {session_id: max(0, counts[session_id] - max_states) for session_id in kept}
+    compacted = []
+    for session_id, raw in records:
+        if session_id not in kept:
+            continue
+        if skip[session_id]:
+            skip[session_id] -= 1
+            continue
+        compacted.append((session_id, raw))
+    return compacted
+
+
+class MentalStateStore:
+    """Append-only binary log of mental states, written in batches by a background thread.
+
+    append() only enqueues, so the request path never waits on disk. Each
+    record is a fixed 14-byte header (type as an enum byte, confidence as
+    uint8, timestamp as int64 microseconds) followed by the session id and
+    description bytes.
+
+    Several workers may share one log: every write, torn-tail repair and
+    compaction holds an exclusive flock on a sidecar lock file. Compaction
+    keeps the last `max_sessions` sessions (`max_states` each), so replay
+    cost stays bounded however long the log has been in use.
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, fsync=False,
+                 max_sessions=MAX_SESSIONS, max_states=MAX_STATES, compact_min_bytes=COMPACT_MIN_BYTES):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_sessions = max_sessions
+        self.max_states = max_states
+        self.compact_min_bytes = compact_min_bytes
+        self.written = 0
+        self.compactions = 0
+        self._queue = queue.Queue()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Beside the log rather than on it: compaction replaces the log file
+        self._lock_path = f"{path}.lock"
+        self._lock = threading.Lock()
+        self._records, size = self._load()
+        self._compact_at = max(self.compact_min_bytes, 2 * size)
+        self._thread = threading.Thread(target=self._writer, name="mental-state-store", daemon=True)
+        self._thread.start()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def append(self, session_id, state):
+        self._queue.put((session_id, state))
+
+    def _writer(self):
+        f = open(self.path, "ab")
+        try:
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                # Coalesce whatever else arrives within the flush interval
+                while item is not None and len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get(timeout=self.flush_interval)
+                    except queue.Empty:
+                        break
+                    batch.append(item)
+                records = []
+                for entry in batch:
+                    if entry is None:
+                        continue
+                    try:
+                        records.append(encode_record(*entry))
+                    except (TypeError, ValueError) as e:
+                        print(f"Skipping unencodable mental state: {e}")
+                if records:
+                    with self._locked():
+                        f = self._reopen_if_replaced(f)
+                        f.write(b"".join(records))
+                        f.flush()
+                        if self.fsync:
+                            os.fsync(f.fileno())
+                        self.written += len(records)
+                        if f.tell() > self._compact_at:
+                            size, _ = self._compact_locked()
+                            self._compact_at = max(self.compact_min_bytes, 2 * size)
+                            f = self._reopen_if_replaced(f)
+                if batch[-1] is None:
+                    return
+        finally:
+            f.close()
+
+    def _reopen_if_replaced(self, f):
+        """`f`, or a fresh append handle if another writer's compaction replaced the log."""
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        opened = os.fstat(f.fileno())
+        if current is not None and (current.st_ino, current.st_dev) == (opened.st_ino, opened.st_dev):
+            return f
+        f.close()
+        if current is None:
+            with open(self.path, "wb") as new:
+                new.write(FILE_MAGIC)
+        return open(self.path, "ab")
+
+    def close(self):
+        """Flush everything queued so far and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def compact(self):
+        """Rewrite the log keeping only what replay would keep; returns its new size."""
+        with self._locked():
+            return self._compact_locked()[0]
+
+    def _read_locked(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            with open(self.path, "wb") as f:
+                f.write(FILE_MAGIC)
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if not data.startswith(FILE_MAGIC):
+            raise ValueError(f"{self.path} is not a mental state log")
+        records, valid = split_records(memoryview(data)[len(FILE_MAGIC):])
+        return data, records, len(FILE_MAGIC) + valid
+
+    def _compact_locked(self, data=None, records=None):
+        if data is None:
+            data, records, _ = self._read_locked()
+        kept = compact_records(records, self.max_sessions, self.max_states)
+        if len(kept) == len(records):
+            return len(data), kept
+        temp_path = f"{self.path}.{os.getpid()}.compact"
+        with open(temp_path, "wb") as f:
+            f.write(FILE_MAGIC)
+            for _, raw in kept:
+                f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(temp_path, self.path)
+        self.compactions += 1
+        return size, kept
+
+    def _load(self):
+        """Records already in the log (compacted) and the log size, torn tail repaired."""
+        with self._locked():
+            data, records, valid = self._read_locked()
+            if valid < len(data):
+                # Safe under the lock: no other writer is mid-record, so the tail is a crash leftover
+                print(f"Truncating {len(data) - valid} torn bytes from {self.path}")
+                with open(self.path, "r+b") as f:
+                    f.truncate(valid)
+                data = data[:valid]
+            size, records = self._compact_locked(data, records)
+            return [(session_id, decode_record(raw)) for session_id, raw in records], size
+
+    def read_session(self, session_id):
+        """Every state logged for one session so far, by any worker, oldest first."""
+        with self._locked():
+            _, records, _ = self._read_locked()
+        return [decode_record(raw) for record_session, raw in records if record_session == session_id]
+
+    def replay(self):
+        """States logged before this store was opened, grouped by session id in write order."""
+        sessions = {}
+        for session_id, state in self._records:
+            sessions.setdefault(session_id, []).append(state)
+        self._records = []
+        return sessions
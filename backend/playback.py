@@ -0,0 +1,146 @@
+import os
+import threading
+
+BYTES_PER_SAMPLE = 2  # int16 mono
+# Audio buffered before playback (re)starts, to absorb network jitter
+JITTER_TARGET_MS = int(os.environ.get("PLAYBACK_JITTER_MS", 80))
+# Audio written to the device per write() call
+PERIOD_MS = int(os.environ.get("PLAYBACK_PERIOD_MS", 20))
+# Ring capacity; model replies arrive faster than real time, so this must
+# hold a whole long answer
+BUFFER_SECONDS = int(os.environ.get("PLAYBACK_BUFFER_SECONDS", 60))
+
+
+class PcmRingBuffer:
+    """Single-producer/single-consumer byte ring for PCM audio.
+
+    write() (event loop) only advances the write position and read_into()
+    (playback thread) only advances the read position, so neither side
+    takes a lock. clear() is a request the reader honours on its next read,
+    which keeps it safe to call from the producer side.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._write_pos = 0
+        self._read_pos = 0
+        self._clear_to = 0
+        self.overrun_bytes = 0
+
+    def buffered(self):
+        return self._write_pos - max(self._read_pos, self._clear_to)
+
+    def write(self, data):
+        """Copy data in; what does not fit is dropped and counted. Returns bytes written."""
+        free = self.capacity - self.buffered()
+        n = min(len(data), free)
+        if n < len(data):
+            self.overrun_bytes += len(data) - n
+        start = self._write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        view = memoryview(data)
+        self._buffer[start:start + first] = view[:first]
+        self._buffer[:n - first] = view[first:n]
+        self._write_pos += n
+        return n
+
+    def read_into(self, out, size):
+        """Copy up to size bytes into out (a bytearray/memoryview). Returns bytes read."""
+        if self._clear_to > self._read_pos:
+            self._read_pos = self._clear_to
+        n = min(size, self._write_pos - self._read_pos)
+        start = self._read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._buffer[start:start + first]
+        out[first:n] = self._buffer[:n - first]
+        self._read_pos += n
+        return n
+
+    def clear(self):
+        """Discard everything written so far (e.g. when the model is interrupted)."""
+        self._clear_to = self._write_pos
+
+
+class PlaybackThread(threading.Thread):
+    """Feeds a blocking output stream from a PcmRingBuffer in fixed periods.
+
+    Playback waits until `jitter_target_ms` of audio is buffered (or has
+    been waiting that long, so short tails still play) before it starts,
+    and again each time the ring runs dry. While waiting it writes
+    silence, so the device paces the thread instead of it spinning.
+    `underruns` counts every time the ring ran dry while playing, which
+    includes the natural end of each reply.
+    """
+
+    def __init__(
+        self,
+        stream,
+        ring,
+        sample_rate,
+        jitter_target_ms=JITTER_TARGET_MS,
+        period_ms=PERIOD_MS,
+    ):
+        super().__init__(name="audio-playback", daemon=True)
+        self.stream = stream
+        self.ring = ring
+        self.bytes_per_second = sample_rate * BYTES_PER_SAMPLE
+        self.period_bytes = sample_rate * period_ms // 1000 * BYTES_PER_SAMPLE
+        self.jitter_target_bytes = sample_rate * jitter_target_ms // 1000 * BYTES_PER_SAMPLE
+        self.jitter_target_periods = max(1, jitter_target_ms // max(period_ms, 1))
+        self._period = bytearray(self.period_bytes)
+        # Allocated once; written as-is whenever a whole period is silent
+        self._silence = bytes(self.period_bytes)
+        self._silence_view = memoryview(self._silence)
+        self._stop_event = threading.Event()
+        self.playing = False
+        self.underruns = 0
+        self.bytes_played = 0
+        self.max_buffered = 0
+
+    def run(self):
+        waited = 0
+        while not self._stop_event.is_set():
+            buffered = self.ring.buffered()
+            self.max_buffered = max(self.max_buffered, buffered)
+            if not self.playing:
+                waited = waited + 1 if buffered else 0
+                if buffered >= max(self.jitter_target_bytes, 1) or waited > self.jitter_target_periods:
+                    self.playing = True
+                    waited = 0
+                else:
+                    self._write(self._silence)
+                    continue
+            n = self.ring.read_into(self._period, self.period_bytes)
+            if n < self.period_bytes:
+                # Ran dry: pad this period with silence and re-buffer
+                self.underruns += 1
+                self.playing = False
+                if n == 0:
+                    self._write(self._silence)
+                    continue
+                self._period[n:] = self._silence_view[n:]
+            self.bytes_played += n
+            # PyAudio's write() only takes immutable bytes, so audio periods need this one copy
+            self._write(bytes(self._period))
+
+    def _write(self, data):
+        try:
+            self.stream.write(data)
+        except Exception as e:
+            print(f"Playback stream error: {e}")
+            self._stop_event.set()
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def stats(self):
+        return {
+            "buffered_ms": self.ring.buffered() * 1000 // self.bytes_per_second,
+            "underruns": self.underruns,
+            "overrun_bytes": self.ring.overrun_bytes,
+            "bytes_played": self.bytes_played,
+            "max_buffered_bytes": self.max_buffered,
+        }
@@ -1,44 +1,72 @@
-import pandas as pd
 import numpy as np
 
-def get_bpm_genre(uploaded_file_path):
-    df = pd.read_csv(uploaded_file_path)
-
-    # Extract relative powers for all channels
-    alpha_cols = [col for col in df.columns if "alpha_rel_power" in col]
-    beta_cols = [col for col in df.columns if "beta_rel_power" in col]
-    theta_cols = [col for col in df.columns if "theta_rel_power" in col]
-    delta_cols = [col for col in df.columns if "delta_rel_power" in col]
-    gamma_cols = [col for col in df.columns if "gamma_rel_power" in col]
-
-    # Calculate mean relative power, replacing NaN with 0
-    alpha_mean = df[alpha_cols].mean(axis=1).fillna(0).iloc[0]
-    beta_mean = df[beta_cols].mean(axis=1).fillna(0).iloc[0]
-    theta_mean = df[theta_cols].mean(axis=1).fillna(0).iloc[0]
-    delta_mean = df[delta_cols].mean(axis=1).fillna(0).iloc[0]
-    gamma_mean = df[gamma_cols].mean(axis=1).fillna(0).iloc[0]
+from backend.eeg_columnar import load_frame
+from backend.eeg_schema import get_schema
+
+BANDS = ("alpha", "beta", "theta", "delta", "gamma")
+BPM_RANGE = (50, 130)
+
+
+def band_means(values, axis=1):
+    """Mean of `values` along `axis`, ignoring NaN (0 where everything is NaN)."""
+    values = np.asarray(values, dtype=np.float64)
+    mask = ~np.isnan(values)
+    sums = np.where(mask, values, 0.0).sum(axis=axis)
+    counts = mask.sum(axis=axis)
+    return np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+
 
+def calmness_from_bands(alpha_mean, beta_mean, theta_mean):
     # Normalize (avoid extreme scaling issues)
     alpha_norm = np.clip(alpha_mean, 0, 1)
     beta_norm = np.clip(beta_mean, 0, 1)
     theta_norm = np.clip(theta_mean, 0, 1)
 
     # Weighted calmness score (alpha weight > theta)
-    calmness_score = (1.2 * alpha_norm + 0.8 * theta_norm) / (beta_norm + 1e-6)
+    return (1.2 * alpha_norm + 0.8 * theta_norm) / (beta_norm + 1e-6)
 
+
+def bpm_from_calmness(calmness_score):
     # Smooth mapping with sigmoid-like scaling
-    bpm_range = (50, 130)
     scaled_score = 1 / (1 + np.exp(- (calmness_score - 1)))
-    bpm = bpm_range[0] + (bpm_range[1] - bpm_range[0]) * scaled_score
+    return BPM_RANGE[0] + (BPM_RANGE[1] - BPM_RANGE[0]) * scaled_score
+
+
+def score_frame(df):
+    """Score every row (epoch) of an EEG feature frame in one pass.
+
+    Returns a dict of 1-D arrays: "bpm", "calmness_score" and "<band>_mean"
+    for each band, all of length len(df).
+    """
+    schema = get_schema(df.columns)
+    bands = schema.select(df, [f"{band}_rel_power" for band in BANDS])
+    # Mean over channels -> (rows, bands)
+    per_band = band_means(bands, axis=1)
+    means = {band: per_band[:, i] for i, band in enumerate(BANDS)}
 
+    calmness_score = np.nan_to_num(calmness_from_bands(means["alpha"], means["beta"], means["theta"]))
+    bpm = np.nan_to_num(bpm_from_calmness(calmness_score))
+
+    scores = {f"{band}_mean": means[band] for band in BANDS}
+    scores["calmness_score"] = calmness_score
+    scores["bpm"] = np.round(bpm, 0)
+    return scores
+
+
+def get_bpm_genre_batch(uploaded_file_path):
+    """Per-row BPM, calmness score and band means for a multi-row recording."""
+    # Memory-mapped columnar copy when the upload has one, else the CSV
+    df = load_frame(uploaded_file_path)
+    return score_frame(df)
+
+
+def wave_data_at(scores, row=0):
     # Replace any possible NaN with 0 in wave_data
-    wave_data = {
-        "alpha_mean": float(np.nan_to_num(alpha_mean)),
-        "beta_mean": float(np.nan_to_num(beta_mean)),
-        "theta_mean": float(np.nan_to_num(theta_mean)),
-        "delta_mean": float(np.nan_to_num(delta_mean)),
-        "gamma_mean": float(np.nan_to_num(gamma_mean)),
-        "calmness_score": float(np.nan_to_num(calmness_score)),
-    }
-
-    return round(float(np.nan_to_num(bpm)), 0), wave_data
\ No newline at end of file
+    wave_data = {f"{band}_mean": float(np.nan_to_num(scores[f"{band}_mean"][row])) for band in BANDS}
+    wave_data["calmness_score"] = float(np.nan_to_num(scores["calmness_score"][row]))
+    return wave_data
+
+
+def get_bpm_genre(uploaded_file_path):
+    scores = get_bpm_genre_batch(uploaded_file_path)
+    return float(scores["bpm"][0]), wave_data_at(scores, 0)
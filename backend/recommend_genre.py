@@ -1,21 +1,17 @@
 import sys
 import json
 import os
-from google import genai
-from google.genai import types
-from pathlib import Path
-from dotenv import load_dotenv
 
-def generate_genre(bpm, wave_data):
-    # Load .env
-    load_dotenv(Path(__file__).parent / ".env")
-    
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print(json.dumps({"error": "No Gemini API key provided"}))
-        return
-    
-    client = genai.Client(api_key=api_key)
+from backend.gemini_client import get_client
+from backend.llm_cache import response_cache
+from backend.genre_model import log_genre, predict_genre
+
+def llm_genre(bpm, wave_data):
+    """Ask Gemini for the genre, bypassing the cache and the local model."""
+    client = get_client()
+    if client is None:
+        raise RuntimeError("No Gemini API key provided")
+    from google.genai import types
     
     model = "gemini-2.5-pro"
     
@@ -38,15 +34,45 @@ def generate_genre(bpm, wave_data):
         ),
     ]
     
+    response_text = ""
+    for chunk in client.models.generate_content_stream(
+        model=model,
+        contents=contents,
+    ):
+        if chunk.text:
+            response_text += chunk.text.strip()
+    return response_text
+
+def generate_genre(bpm, wave_data):
+    cache_key = response_cache.key("genre", bpm, wave_data["calmness_score"])
+    cached_genre = response_cache.get(cache_key)
+    if cached_genre is not None:
+        return json.dumps({
+            "genre": cached_genre,
+            "wave_data": wave_data
+        })
+    
+    # Confident local answer: no LLM round-trip
+    local_genre = predict_genre(bpm, wave_data)
+    if local_genre is not None:
+        return json.dumps({
+            "genre": local_genre,
+            "wave_data": wave_data
+        })
+    
+    if get_client() is None:
+        print(json.dumps({"error": "No Gemini API key provided"}))
+        return
+    
     try:
-        response_text = ""
-        for chunk in client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-        ):
-            if chunk.text:
-                response_text += chunk.text.strip()
+        response_text = llm_genre(bpm, wave_data)
         
+        if response_text:
+            response_cache.put(cache_key, response_text)
+            try:
+                log_genre(bpm, wave_data, response_text)
+            except OSError as e:
+                print(f"Could not log genre answer: {e}")
         return json.dumps({
             "genre": response_text,
             "wave_data": wave_data
@@ -54,4 +80,3 @@ def generate_genre(bpm, wave_data):
     
     except Exception as e:
         return json.dumps({"bpm": bpm, "error": str(e)})
-
@@ -1,25 +1,41 @@
-from pathlib import Path
 import sys
 import json
 import os
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+import asyncio
+import functools
+
+from backend.gemini_client import get_client
+from backend.llm_cache import response_cache
+
+MODEL = "gemini-2.5-pro"
+SONG_CONCURRENCY = int(os.environ.get("SONG_CONCURRENCY", 4))
+SONG_TIMEOUT = float(os.environ.get("SONG_TIMEOUT", 60))
+SONG_FIELDS = ("title", "artist", "album", "link")
+
+@functools.cache
+def song_list_schema():
+    # google.genai is slow to import, so the schema is built on first use
+    from google.genai import types
+
+    return types.Schema(
+        type=types.Type.ARRAY,
+        items=types.Schema(
+            type=types.Type.OBJECT,
+            properties={field: types.Schema(type=types.Type.STRING) for field in SONG_FIELDS},
+            required=list(SONG_FIELDS),
+        ),
+    )
 
 def ask_gemini(prompt):
     """Helper function to query Gemini and return plain text."""
-    load_dotenv(Path(__file__).parent / ".env")
-    
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        return "No API key"
-    
-    client = genai.Client(api_key=api_key)
-    model = "gemini-2.5-pro"
+    client = get_client()
+    if client is None:
+        raise RuntimeError("No Gemini API key provided")
+    from google.genai import types
     
     response_text = ""
     for chunk in client.models.generate_content_stream(
-        model=model,
+        model=MODEL,
         contents=[types.Content(role="user", parts=[types.Part.from_text(text=prompt)])],
     ):
         if chunk.text:
@@ -31,6 +47,8 @@ def generate_songs(bpm, genre):
     """Get song recommendation one field at a time for stability."""
     
     title = ask_gemini(f"Give me ONLY the name of a popular {genre} song with BPM around {bpm}. No extra words.")
+    if not title:
+        raise ValueError("Empty song title from Gemini")
     artist = ask_gemini(f"Give me ONLY the artist of the song '{title}'. No extra words.")
     album = ask_gemini(f"Give me ONLY the album name of the song '{title}' by '{artist}'. No extra words.")
     link = ask_gemini(f"Give me ONLY the valid link for the song '{title}' by '{artist}'. No extra words.")
@@ -41,3 +59,82 @@ def generate_songs(bpm, genre):
         "album": album,
         "link": link
     })
+
+def generate_songs_structured(bpm, genre, count=4):
+    """Get `count` song recommendations, every field included, in one schema-constrained call."""
+    client = get_client()
+    if client is None:
+        raise RuntimeError("No API key")
+    from google.genai import types
+
+    response = client.models.generate_content(
+        model=MODEL,
+        contents=[types.Content(role="user", parts=[types.Part.from_text(text=(
+            f"Recommend {count} different popular {genre} songs with BPM around {bpm}. "
+            "For each song give the title, the artist, the album name and a valid link to the song."
+        ))])],
+        config=types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=song_list_schema(),
+        ),
+    )
+    
+    songs = json.loads(response.text)
+    if not isinstance(songs, list) or len(songs) < count:
+        raise ValueError(f"Expected {count} songs, got: {response.text[:200]}")
+    songs = [{field: str(song.get(field, "")).strip() for field in SONG_FIELDS} for song in songs[:count]]
+    if not all(song["title"] for song in songs):
+        raise ValueError("Structured response is missing song titles")
+    
+    return json.dumps(songs)
+
+def _song_cache_key(bpm, genre, count):
+    return response_cache.key("songs", bpm, None, genre, count)
+
+def _cache_song_list(cache_key, song_json, count):
+    # Only cache complete, well-formed answers; partial or failed results are retried next time
+    songs = json.loads(song_json)
+    if len(songs) == count and all(isinstance(song, dict) and song.get("title") for song in songs):
+        response_cache.put(cache_key, song_json)
+    return song_json
+
+async def generate_song_list_async(bpm, genre, count=4, concurrency=SONG_CONCURRENCY, timeout=SONG_TIMEOUT):
+    """Get `count` songs in one structured call, falling back to the per-field path.
+    
+    Runs off the event loop. The per-field fallback runs as up to
+    `concurrency` concurrent worker threads, each waited on for `timeout`
+    seconds; songs that fail or time out are left out, so the result may
+    hold fewer than `count` songs.
+    """
+    cache_key = _song_cache_key(bpm, genre, count)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    try:
+        song_json = await asyncio.wait_for(asyncio.to_thread(generate_songs_structured, bpm, genre, count), timeout)
+        return _cache_song_list(cache_key, song_json, count)
+    except Exception as e:
+        print(f"Structured song request failed, falling back to per-field requests: {e!r}")
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    def release(task):
+        semaphore.release()
+        if not task.cancelled():
+            task.exception()  # retrieved here so a timed-out failure is not logged as unhandled
+    
+    async def one_song():
+        await semaphore.acquire()
+        task = asyncio.ensure_future(asyncio.to_thread(generate_songs, bpm, genre))
+        # A timed-out worker thread keeps calling Gemini, so it keeps its slot until it finishes
+        task.add_done_callback(release)
+        song_json = await asyncio.wait_for(asyncio.shield(task), timeout)
+        return json.loads(song_json)
+    
+    results = await asyncio.gather(*(one_song() for _ in range(count)), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Song request failed: {result!r}")
+    song_json = json.dumps([result for result in results if not isinstance(result, Exception)])
+    return _cache_song_list(cache_key, song_json, count)
@@ -0,0 +1,274 @@
+import contextlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialised
+    fcntl = None
+
+# "mmap" (default), "sqlite" or "memory" (single process only)
+SHARED_STATE_BACKEND = os.environ.get("SHARED_STATE_BACKEND", "mmap")
+SHARED_STATE_PATH = os.environ.get("SHARED_STATE_PATH") or None
+SHARED_STATE_SLOTS = int(os.environ.get("SHARED_STATE_SLOTS", 4096))
+SHARED_STATE_SLOT_SIZE = int(os.environ.get("SHARED_STATE_SLOT_SIZE", 1024))
+
+
+class SharedStateFull(RuntimeError):
+    """Every slot of the shared table holds a live entry."""
+
+
+def _encode(value):
+    # Raw UTF-8 rather than \uXXXX escapes, so non-ASCII text takes fewer slot bytes
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+class MemoryStateBackend:
+    """Per-process dict; only correct with a single worker."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            value = self._data.get((namespace, key))
+        return default if value is None else json.loads(value)
+
+    def set(self, namespace, key, value):
+        with self._lock:
+            self._data[(namespace, key)] = _encode(value)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            return self._data.pop((namespace, key), None) is not None
+
+    def items(self, namespace):
+        with self._lock:
+            return {k: json.loads(v) for (ns, k), v in self._data.items() if ns == namespace}
+
+
+class SqliteStateBackend:
+    """Key/value table in a WAL-mode SQLite file shared by every worker on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM shared_state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, namespace, key, value):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO shared_state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, _encode(value), time.time()),
+            )
+
+    def delete(self, namespace, key):
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM shared_state WHERE namespace = ? AND key = ?", (namespace, key))
+        return cursor.rowcount > 0
+
+    def items(self, namespace):
+        with self._lock:
+            rows = self._db.execute("SELECT key, value FROM shared_state WHERE namespace = ?", (namespace,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+
+class MmapStateBackend:
+    """Fixed-size open-addressing hash table in a memory-mapped file.
+
+    Every worker maps the same file, so reads are plain memory access with
+    no server or syscalls beyond the lock. Each (namespace, key) lives in one
+    `slot_size` byte slot holding a small header, the key and the JSON
+    value; writes take an exclusive flock, reads a shared one.
+    """
+
+    MAGIC = b"SST1"
+    HEADER = struct.Struct("<4sII")  # magic, slot count, slot size
+    SLOT = struct.Struct("<BHI")  # state, key length, value length
+    EMPTY, USED, DELETED = 0, 1, 2
+
+    def __init__(self, path, slots=SHARED_STATE_SLOTS, slot_size=SHARED_STATE_SLOT_SIZE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.compactions = 0
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked(exclusive=True):
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, self.HEADER.size + slots * slot_size)
+                os.pwrite(self._fd, self.HEADER.pack(self.MAGIC, slots, slot_size), 0)
+            magic, self.slots, self.slot_size = self.HEADER.unpack(os.pread(self._fd, self.HEADER.size, 0))
+            if magic != self.MAGIC:
+                raise ValueError(f"{path} is not a shared state file")
+            self._map = mmap.mmap(self._fd, self.HEADER.size + self.slots * self.slot_size)
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive):
+        # flock serialises processes; threads of this process share the fd, so also need the lock
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key_bytes(namespace, key):
+        return f"{namespace}\0{key}".encode("utf-8")
+
+    def _offset(self, index):
+        return self.HEADER.size + index * self.slot_size
+
+    def _probe(self, key_bytes):
+        """Yield (slot index, state, stored key) along key_bytes' probe sequence."""
+        start = zlib.crc32(key_bytes) % self.slots
+        for i in range(self.slots):
+            index = (start + i) % self.slots
+            offset = self._offset(index)
+            state, key_len, _ = self.SLOT.unpack_from(self._map, offset)
+            if state == self.EMPTY:
+                yield index, state, None
+                return
+            body = offset + self.SLOT.size
+            yield index, state, self._map[body:body + key_len]
+
+    def _find(self, key_bytes):
+        for index, state, stored in self._probe(key_bytes):
+            if state == self.USED and stored == key_bytes:
+                return index
+        return None
+
+    def _read_value(self, index):
+        offset = self._offset(index)
+        _, key_len, value_len = self.SLOT.unpack_from(self._map, offset)
+        body = offset + self.SLOT.size + key_len
+        return json.loads(self._map[body:body + value_len])
+
+    def get(self, namespace, key, default=None):
+        key_bytes = self._key_bytes(namespace, key)
+        with self._locked(exclusive=False):
+            index = self._find(key_bytes)
+            return default if index is None else self._read_value(index)
+
+    def _insert(self, key_bytes, value_bytes):
+        """Write one entry (caller holds the exclusive lock).
+
+        Returns (written, reached_empty): written is False when every slot
+        holds another live entry, and reached_empty is False when the probe
+        found no EMPTY slot at all, i.e. tombstones have filled the table.
+        """
+        target = None
+        reached_empty = False
+        for index, state, stored in self._probe(key_bytes):
+            if state == self.USED and stored == key_bytes:
+                target = index
+                reached_empty = True
+                break
+            if state == self.EMPTY:
+                reached_empty = True
+            if state != self.USED and target is None:
+                target = index
+        if target is None:
+            return False, reached_empty
+        offset = self._offset(target)
+        body = offset + self.SLOT.size
+        self._map[body:body + len(key_bytes)] = key_bytes
+        self._map[body + len(key_bytes):body + len(key_bytes) + len(value_bytes)] = value_bytes
+        # Header last: a slot only becomes USED once its key and value are in place
+        self.SLOT.pack_into(self._map, offset, self.USED, len(key_bytes), len(value_bytes))
+        return True, reached_empty
+
+    def _compact(self):
+        """Re-insert every live entry into a cleared table, dropping tombstones (exclusive lock held)."""
+        live = []
+        for index in range(self.slots):
+            offset = self._offset(index)
+            state, key_len, value_len = self.SLOT.unpack_from(self._map, offset)
+            if state == self.USED:
+                body = offset + self.SLOT.size
+                live.append((self._map[body:body + key_len], self._map[body + key_len:body + key_len + value_len]))
+        self._map[self.HEADER.size:] = bytes(self.slots * self.slot_size)
+        for key_bytes, value_bytes in live:
+            self._insert(key_bytes, value_bytes)
+        self.compactions += 1
+
+    def set(self, namespace, key, value):
+        key_bytes = self._key_bytes(namespace, key)
+        value_bytes = _encode(value).encode("utf-8")
+        if self.SLOT.size + len(key_bytes) + len(value_bytes) > self.slot_size:
+            raise ValueError(f"Shared state entry {namespace}/{key} is larger than a {self.slot_size} byte slot")
+        with self._locked(exclusive=True):
+            written, reached_empty = self._insert(key_bytes, value_bytes)
+            if not reached_empty:
+                # Lookups of missing keys now scan the whole table; rebuild it without tombstones
+                self._compact()
+                if not written:
+                    written, _ = self._insert(key_bytes, value_bytes)
+            if not written:
+                raise SharedStateFull(
+                    f"Shared state is full ({self.slots} live entries); raise SHARED_STATE_SLOTS"
+                )
+
+    def delete(self, namespace, key):
+        key_bytes = self._key_bytes(namespace, key)
+        with self._locked(exclusive=True):
+            index = self._find(key_bytes)
+            if index is None:
+                return False
+            next_state, _, _ = self.SLOT.unpack_from(self._map, self._offset((index + 1) % self.slots))
+            # A tombstone keeps later entries of the same probe chain reachable; at the
+            # end of a chain there are none, so the slot can go straight back to EMPTY
+            state = self.EMPTY if next_state == self.EMPTY else self.DELETED
+            self.SLOT.pack_into(self._map, self._offset(index), state, 0, 0)
+            return True
+
+    def items(self, namespace):
+        prefix = f"{namespace}\0".encode("utf-8")
+        result = {}
+        with self._locked(exclusive=False):
+            for index in range(self.slots):
+                offset = self._offset(index)
+                state, key_len, _ = self.SLOT.unpack_from(self._map, offset)
+                if state != self.USED:
+                    continue
+                body = offset + self.SLOT.size
+                stored = self._map[body:body + key_len]
+                if stored.startswith(prefix):
+                    result[stored[len(prefix):].decode("utf-8")] = self._read_value(index)
+        return result
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def open_state_backend(kind=SHARED_STATE_BACKEND, path=SHARED_STATE_PATH):
+    """The shared-state backend selected by SHARED_STATE_BACKEND."""
+    if kind == "memory":
+        return MemoryStateBackend()
+    if kind == "sqlite":
+        return SqliteStateBackend(path or "shared_state.db")
+    if kind == "mmap":
+        return MmapStateBackend(path or "shared_state.mmap")
+    raise ValueError(f"Unknown shared state backend: {kind}")
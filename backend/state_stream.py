@@ -0,0 +1,86 @@
+import asyncio
+from collections import OrderedDict
+
+# Updates arriving within this window are merged into one message per session
+COALESCE_WINDOW = 0.1
+# Sessions with unsent updates a subscriber may have before the oldest is dropped
+MAX_PENDING = 64
+
+
+class Subscription:
+    """One consumer's view of the state stream.
+
+    Only the newest state per session is kept while the consumer is busy,
+    so a burst of updates collapses into one message, and a slow consumer
+    costs at most `max_pending` entries instead of an unbounded queue.
+    """
+
+    def __init__(self, session_id=None, max_pending=MAX_PENDING):
+        self.session_id = session_id
+        self.max_pending = max_pending
+        self.coalesced = 0
+        self.dropped = 0
+        self._pending = OrderedDict()
+        self._last_sent = {}
+        self._event = asyncio.Event()
+
+    def offer(self, session_id, state):
+        if self.session_id is not None and session_id != self.session_id:
+            return
+        if session_id in self._pending:
+            self.coalesced += 1
+        self._pending[session_id] = state
+        self._pending.move_to_end(session_id)
+        while len(self._pending) > self.max_pending:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+        self._event.set()
+
+    def _delta(self, session_id, state):
+        previous = self._last_sent.get(session_id)
+        self._last_sent[session_id] = dict(state)
+        if previous is None:
+            return {"type": "mentalState", "sessionId": session_id, "full": True, "changes": dict(state)}
+        changes = {key: value for key, value in state.items() if previous.get(key) != value}
+        if not changes:
+            return None
+        return {"type": "mentalState", "sessionId": session_id, "full": False, "changes": changes}
+
+    async def next_messages(self, coalesce_window=COALESCE_WINDOW):
+        """Wait for updates and return them as per-session delta messages."""
+        while True:
+            await self._event.wait()
+            if coalesce_window:
+                await asyncio.sleep(coalesce_window)
+            self._event.clear()
+            pending, self._pending = self._pending, OrderedDict()
+            messages = [self._delta(session_id, state) for session_id, state in pending.items()]
+            messages = [message for message in messages if message is not None]
+            if messages:
+                return messages
+
+
+class StateBroker:
+    """In-process pub/sub for mental-state updates.
+
+    publish() must be called from the event loop thread; it never awaits,
+    so producers are not slowed down by subscribers.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, session_id=None, max_pending=MAX_PENDING):
+        subscription = Subscription(session_id, max_pending)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions.discard(subscription)
+
+    def publish(self, session_id, state):
+        for subscription in list(self._subscriptions):
+            subscription.offer(session_id, state)
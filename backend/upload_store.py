@@ -0,0 +1,177 @@
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialised
+    fcntl = None
+
+# Per-user limits; the user's least recently used uploads are dropped past either
+UPLOAD_QUOTA_BYTES = int(os.environ.get("UPLOAD_QUOTA_BYTES", 512 * 1024 * 1024))
+UPLOAD_MAX_FILES = int(os.environ.get("UPLOAD_MAX_FILES", 50))
+# Manifest writes for a mere read are skipped if the upload was used this recently
+TOUCH_INTERVAL = 60
+
+
+class UploadStore:
+    """Content-addressed EEG uploads with per-user manifests.
+
+    Each distinct file is stored once as blobs/<sha256>.csv, however many
+    users upload it; the sha256 doubles as the upload id. A user's manifest
+    (manifests/<sha1 of user id>.json) lists the uploads they own. When a
+    user goes over `quota_bytes` or `max_files` their least recently used
+    uploads are dropped, and blobs no manifest references are deleted.
+    Manifests are replaced atomically and every change holds a lock file,
+    so several workers can share one store directory.
+    """
+
+    def __init__(self, root, quota_bytes=UPLOAD_QUOTA_BYTES, max_files=UPLOAD_MAX_FILES):
+        self.root = os.path.abspath(root)
+        self.quota_bytes = quota_bytes
+        self.max_files = max_files
+        self.blob_dir = os.path.join(self.root, "blobs")
+        self.manifest_dir = os.path.join(self.root, "manifests")
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        for directory in (self.blob_dir, self.manifest_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(self.root, ".lock")
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def blob_path(self, upload_id):
+        if len(upload_id) != 64 or any(c not in "0123456789abcdef" for c in upload_id):
+            raise ValueError(f"Invalid upload id: {upload_id}")
+        return os.path.join(self.blob_dir, f"{upload_id}.csv")
+
+    def temp_path(self):
+        """Where to stream a new upload before its hash is known."""
+        return os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.part")
+
+    def _manifest_path(self, user_id):
+        return os.path.join(self.manifest_dir, hashlib.sha1(user_id.encode("utf-8")).hexdigest() + ".json")
+
+    def _read_manifest(self, user_id):
+        try:
+            with open(self._manifest_path(user_id)) as f:
+                return json.load(f)["uploads"]
+        except FileNotFoundError:
+            return []
+
+    def _write_manifest(self, user_id, uploads):
+        path = self._manifest_path(user_id)
+        if not uploads:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            return
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"userId": user_id, "uploads": uploads}, f)
+        os.replace(tmp, path)
+
+    def _referenced(self):
+        referenced = set()
+        for name in os.listdir(self.manifest_dir):
+            if name.endswith(".json"):
+                with open(os.path.join(self.manifest_dir, name)) as f:
+                    referenced.update(entry["uploadId"] for entry in json.load(f)["uploads"])
+        return referenced
+
+    def _collect(self, upload_ids):
+        """Delete the blobs among upload_ids that no manifest references any more."""
+        if not upload_ids:
+            return []
+        referenced = self._referenced()
+        removed = []
+        for upload_id in set(upload_ids) - referenced:
+            blob = self.blob_path(upload_id)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(blob)
+                removed.append(upload_id)
+            # Derived files next to the blob, e.g. its columnar copy
+            for derived in glob.glob(os.path.join(self.blob_dir, f"{upload_id}.*")):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(derived)
+        return removed
+
+    def commit(self, temp_path, upload_id, user_id, filename):
+        """Move a finished upload into place and add it to the user's manifest.
+
+        Returns (entry, deduplicated, removed upload ids).
+        """
+        blob = self.blob_path(upload_id)
+        now = time.time()
+        with self._locked():
+            deduplicated = os.path.exists(blob)
+            if deduplicated:
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, blob)
+            uploads = [entry for entry in self._read_manifest(user_id) if entry["uploadId"] != upload_id]
+            entry = {
+                "uploadId": upload_id,
+                "filename": filename,
+                "size": os.path.getsize(blob),
+                "uploadedAt": now,
+                "lastUsed": now,
+            }
+            uploads.append(entry)
+            uploads, evicted = self._enforce_quota(uploads)
+            self._write_manifest(user_id, uploads)
+            removed = self._collect([e["uploadId"] for e in evicted])
+        return entry, deduplicated, removed
+
+    def _enforce_quota(self, uploads):
+        """Drop least recently used uploads (never the newest) until within quota."""
+        keep = sorted(uploads, key=lambda e: e["lastUsed"])
+        evicted = []
+        while len(keep) > 1 and (
+            len(keep) > self.max_files or sum(e["size"] for e in keep) > self.quota_bytes
+        ):
+            evicted.append(keep.pop(0))
+        kept_ids = {e["uploadId"] for e in keep}
+        return [e for e in uploads if e["uploadId"] in kept_ids], evicted
+
+    def uploads(self, user_id):
+        """The user's manifest, oldest upload first."""
+        return self._read_manifest(user_id)
+
+    def get(self, user_id, upload_id=None):
+        """The user's upload `upload_id` (default: their latest), or None if they do not own it."""
+        uploads = self._read_manifest(user_id)
+        if upload_id is None:
+            entry = max(uploads, key=lambda e: e["uploadedAt"], default=None)
+        else:
+            entry = next((e for e in uploads if e["uploadId"] == upload_id), None)
+        if entry is not None and time.time() - entry["lastUsed"] > TOUCH_INTERVAL:
+            self._touch(user_id, entry["uploadId"])
+        return entry
+
+    def _touch(self, user_id, upload_id):
+        with self._locked():
+            uploads = self._read_manifest(user_id)
+            for entry in uploads:
+                if entry["uploadId"] == upload_id:
+                    entry["lastUsed"] = time.time()
+            self._write_manifest(user_id, uploads)
+
+    def remove(self, user_id, upload_id):
+        """Drop an upload from the user's manifest. Returns the blobs deleted as a result."""
+        with self._locked():
+            uploads = self._read_manifest(user_id)
+            remaining = [e for e in uploads if e["uploadId"] != upload_id]
+            if len(remaining) == len(uploads):
+                return None
+            self._write_manifest(user_id, remaining)
+            return self._collect([upload_id])
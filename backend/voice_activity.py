@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+
+# RMS level (int16 units) a chunk needs to count as speech
+ENERGY_THRESHOLD = float(os.environ.get("VAD_ENERGY_THRESHOLD", 500))
+# Chunks whose zero-crossing rate is above this are treated as hiss/noise, not voice
+MAX_ZERO_CROSSING_RATE = float(os.environ.get("VAD_MAX_ZCR", 0.35))
+# Silent chunks still sent after speech, so word endings and the server's
+# own end-of-turn detection are not cut off
+HANGOVER_CHUNKS = int(os.environ.get("VAD_HANGOVER_CHUNKS", 8))
+# Silent chunks kept before speech starts and sent with it
+PRE_ROLL_CHUNKS = int(os.environ.get("VAD_PRE_ROLL_CHUNKS", 2))
+# Send one in every N chunks of sustained silence (0 drops all of it)
+SILENCE_KEEPALIVE = int(os.environ.get("VAD_SILENCE_KEEPALIVE", 16))
+# Speech chunks coalesced into one send
+BATCH_CHUNKS = int(os.environ.get("AUDIO_BATCH_CHUNKS", 4))
+
+
+def chunk_features(data):
+    """RMS energy and zero-crossing rate of an int16 PCM chunk."""
+    samples = np.frombuffer(data, dtype=np.int16)
+    if samples.size == 0:
+        return 0.0, 0.0
+    values = samples.astype(np.float32)
+    rms = float(np.sqrt(np.dot(values, values) / values.size))
+    signs = np.signbit(samples)
+    zcr = float(np.count_nonzero(signs[1:] != signs[:-1])) / max(samples.size - 1, 1)
+    return rms, zcr
+
+
+class VoiceActivityGate:
+    """Drops silent mic audio and coalesces speech into larger frames.
+
+    feed() takes raw int16 chunks as read from the mic and returns the
+    (possibly empty) list of byte strings to send upstream. Silence is
+    decimated to one chunk in `silence_keepalive`, and speech is buffered
+    until `batch_chunks` chunks are ready or the speaker stops.
+    """
+
+    def __init__(
+        self,
+        energy_threshold=ENERGY_THRESHOLD,
+        max_zero_crossing_rate=MAX_ZERO_CROSSING_RATE,
+        hangover_chunks=HANGOVER_CHUNKS,
+        pre_roll_chunks=PRE_ROLL_CHUNKS,
+        silence_keepalive=SILENCE_KEEPALIVE,
+        batch_chunks=BATCH_CHUNKS,
+    ):
+        self.energy_threshold = energy_threshold
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+        self.hangover_chunks = hangover_chunks
+        self.pre_roll_chunks = pre_roll_chunks
+        self.silence_keepalive = silence_keepalive
+        self.batch_chunks = max(1, batch_chunks)
+        self._batch = []
+        self._pre_roll = []
+        self._hangover = 0
+        self._silent_run = 0
+        self.chunks_in = 0
+        self.chunks_voiced = 0
+        self.chunks_dropped = 0
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def is_speech(self, data):
+        rms, zcr = chunk_features(data)
+        return rms >= self.energy_threshold and zcr <= self.max_zero_crossing_rate
+
+    def _emit(self):
+        if not self._batch:
+            return []
+        frame = b"".join(self._batch)
+        self._batch = []
+        self.frames_out += 1
+        self.bytes_out += len(frame)
+        return [frame]
+
+    def feed(self, data):
+        self.chunks_in += 1
+        self.bytes_in += len(data)
+        if self.is_speech(data):
+            self.chunks_voiced += 1
+            if self._hangover == 0 and self._pre_roll:
+                self._batch.extend(self._pre_roll)
+                self.chunks_dropped -= len(self._pre_roll)
+            self._pre_roll = []
+            self._hangover = self.hangover_chunks
+            self._silent_run = 0
+            self._batch.append(data)
+        elif self._hangover > 0:
+            # Trailing silence after speech goes out with it
+            self._hangover -= 1
+            self._batch.append(data)
+            if self._hangover == 0:
+                return self._emit()
+        else:
+            self._silent_run += 1
+            if self.silence_keepalive and self._silent_run % self.silence_keepalive == 0:
+                self._batch.append(data)
+                return self._emit()
+            self.chunks_dropped += 1
+            if self.pre_roll_chunks:
+                self._pre_roll.append(data)
+                del self._pre_roll[:-self.pre_roll_chunks]
+            return []
+        if len(self._batch) >= self.batch_chunks:
+            return self._emit()
+        return []
+
+    def flush(self):
+        """Whatever speech is still buffered."""
+        self._pre_roll = []
+        self._hangover = 0
+        return self._emit()
+
+    def stats(self):
+        return {
+            "chunks_in": self.chunks_in,
+            "chunks_voiced": self.chunks_voiced,
+            "chunks_dropped": self.chunks_dropped,
+            "frames_out": self.frames_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
@@ -62,6 +62,9 @@ import { useOutsideClick } from "@/hooks/use-outside-click";
 import { useAudio } from "@/lib/AudioContext";
 
 
+// localStorage key of the last backend session id, so its history survives a reload
+const SESSION_ID_KEY = "mentalStateSessionId";
+
 interface BrainwaveData {
   alpha: number;
   beta: number;
@@ -408,6 +411,13 @@ export default function MentalState() {
   const [currentMentalState, setCurrentMentalState] = useState<MentalState | null>(null);
   const [signalQuality, setSignalQuality] = useState(0);
   const [isConnected, setIsConnected] = useState(false);
+  // Backend session of the current (or last) recording; every session call names it.
+  // Kept in state too, so effects re-run once the start request resolves, and remembered
+  // across reloads so the history of the last recording shows on mount
+  const [sessionId, setSessionId] = useState<string | null>(
+    () => window.localStorage.getItem(SESSION_ID_KEY)
+  );
+  const sessionIdRef = useRef<string | null>(sessionId);
   
   // Effect to update mental state based on brainwave data from context
   useEffect(() => {
@@ -481,9 +491,22 @@ export default function MentalState() {
     });
   };
 
+  const stopBackendSession = () => {
+    const sessionId = sessionIdRef.current;
+    if (!sessionId) {
+      return Promise.resolve(new Response(JSON.stringify({ status: "stopped" })));
+    }
+    return fetch(`http://localhost:8008/api/session/stop?session_id=${encodeURIComponent(sessionId)}`, {
+      method: 'POST',
+    });
+  };
+
   // Connect to the backend API
   useEffect(() => {
     if (isRecording) {
+      // Forget the last recording's session until the new one is known
+      sessionIdRef.current = null;
+      setSessionId(null);
       // Start the session on the backend
       fetch('http://localhost:8008/api/session/start', {
         method: 'POST',
@@ -491,53 +514,71 @@ export default function MentalState() {
       .then(response => response.json())
       .then(data => {
         console.log("Session started:", data);
+        sessionIdRef.current = data.sessionId ?? null;
+        setSessionId(sessionIdRef.current);
+        if (sessionIdRef.current) {
+          window.localStorage.setItem(SESSION_ID_KEY, sessionIdRef.current);
+        }
       })
       .catch(error => {
         console.error("Error starting session:", error);
         setIsConnected(false);
       });
 
-      // Set up a timer to update recording time and fetch data from the backend
+      // Recording clock; state updates arrive over the WebSocket subscription below
       const interval = setInterval(() => {
         setRecordingTime(prev => prev + 1);
-        
-        // Get current mental state from backend
-        fetch('http://localhost:8008/api/mental-state')
-          .then(response => response.json())
-          .then(data => {
-            if (data.mentalState) {
-              // We're now using brainwave data from context, so we update it
-              // using the updateBrainwaveData function instead of the non-existent setBrainwaveData
-              updateBrainwaveData({
-                alpha: Math.random() * 100,  // Replace with actual data when available
-                beta: Math.random() * 100,
-                theta: Math.random() * 100,
-                delta: Math.random() * 100,
-                gamma: Math.random() * 100
-              });
-              
-              setSignalQuality(80); // Simulated good signal
-            }
-          })
-          .catch(error => {
-            console.error("Error fetching mental state:", error);
-            setSignalQuality(prev => Math.max(prev - 10, 0)); // Decrease signal quality on error
-          });
       }, 1000);
 
       return () => {
         clearInterval(interval);
         // Stop the session when recording stops
-        fetch('http://localhost:8008/api/session/stop', {
-          method: 'POST',
-        }).catch(console.error);
+        stopBackendSession().catch(console.error);
       };
     }
   }, [isRecording]);
 
+  // Stream the session's mental state instead of polling GET /api/mental-state
+  useEffect(() => {
+    if (!isRecording || !sessionId) return;
+    const socket = new WebSocket('ws://localhost:8008/ws');
+
+    socket.onopen = () => {
+      socket.send(JSON.stringify({ type: 'subscribe', sessionId }));
+    };
+    socket.onmessage = event => {
+      const data = JSON.parse(event.data);
+      if (data.status === 'subscribed') {
+        setSignalQuality(80); // Simulated good signal
+      } else if (data.type === 'mentalState') {
+        // We're now using brainwave data from context, so we update it
+        // using the updateBrainwaveData function instead of the non-existent setBrainwaveData
+        updateBrainwaveData({
+          alpha: Math.random() * 100,  // Replace with actual data when available
+          beta: Math.random() * 100,
+          theta: Math.random() * 100,
+          delta: Math.random() * 100,
+          gamma: Math.random() * 100
+        });
+
+        setSignalQuality(80); // Simulated good signal
+      } else if (data.status === 'error') {
+        console.error("Error subscribing to mental state:", data.error);
+      }
+    };
+    socket.onerror = error => {
+      console.error("Mental state stream error:", error);
+      setSignalQuality(prev => Math.max(prev - 10, 0)); // Decrease signal quality on error
+    };
+
+    return () => {
+      socket.close();
+    };
+  }, [isRecording, sessionId]);
+
   // Analyze mental state based on brainwave data
   useEffect(() => {
-    if (isRecording && signalQuality > 50) {
+    if (isRecording && signalQuality > 50 && sessionIdRef.current) {
       // Send a message to analyze mental state
       const message = "User is currently being monitored.";
       
@@ -546,7 +587,7 @@ export default function MentalState() {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ text: message }),
+        body: JSON.stringify({ text: message, sessionId: sessionIdRef.current }),
       })
         .then(response => response.json())
         .then(data => {
@@ -597,19 +638,7 @@ export default function MentalState() {
     setIsRecording(true);
     setRecordingTime(0);
     setIsConnected(true);
-    
-    // Send a message to start processing in the backend
-    fetch('http://localhost:8008/api/session/start', {
-      method: 'POST',
-    })
-    .then(response => response.json())
-    .then(data => {
-      console.log("Session started:", data);
-    })
-    .catch(error => {
-      console.error("Error starting session:", error);
-      setIsConnected(false);
-    });
+    // The recording effect starts the backend session
   };
 
   const stopRecording = () => {
@@ -617,9 +646,7 @@ export default function MentalState() {
     setIsConnected(false);
     
     // Send a message to stop processing in the backend
-    fetch('http://localhost:8008/api/session/stop', {
-      method: 'POST',
-    })
+    stopBackendSession()
     .then(response => response.json())
     .then(data => {
       console.log("Session stopped:", data);
@@ -644,9 +671,7 @@ export default function MentalState() {
     setIsConnected(false);
     
     // Stop the session on the backend
-    fetch('http://localhost:8008/api/session/stop', {
-      method: 'POST',
-    }).catch(console.error);
+    stopBackendSession().catch(console.error);
   };
 
   const [historyData, setHistoryData] = useState([
@@ -664,8 +689,9 @@ export default function MentalState() {
 
   // Fetch history data
   useEffect(() => {
-    // Only fetch when recording or when component mounts
-    fetch('http://localhost:8008/api/mental-state/history')
+    // On mount (last session), on start once the id arrives, and again on stop
+    if (!sessionId) return;
+    fetch(`http://localhost:8008/api/mental-state/history?session_id=${encodeURIComponent(sessionId)}`)
       .then(response => response.json())
       .then(data => {
         if (data.history && data.history.length > 0) {
@@ -712,7 +738,7 @@ export default function MentalState() {
       .catch(error => {
         console.error("Error fetching history:", error);
       });
-  }, [isRecording]);
+  }, [isRecording, sessionId]);
 
   return (
     <div className="min-h-screen bg-gradient-to-b from-[#232323] via-[#1c1c1c] to-[#141414] text-white">
@@ -1,42 +1,56 @@
 import sys
 import json
 import uvicorn
-import shutil
 import os
 import asyncio
 import base64
+import hashlib
 import threading
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+import time
+import numpy as np
+from backend.gemini_client import get_api_key, get_client
 
 # Debug: Check if the API key is loaded
-api_key = os.environ.get("GEMINI_API_KEY")
+api_key = get_api_key()
 if api_key:
     print(f"GEMINI_API_KEY loaded successfully: {api_key[:5]}...")
 else:
     print("WARNING: GEMINI_API_KEY not found in environment variables!")
 
-from google import genai
-from google.genai import types
-from fastapi import FastAPI, File, UploadFile, WebSocket, WebSocketDisconnect, BackgroundTasks, HTTPException
+from fastapi import FastAPI, File, UploadFile, WebSocket, WebSocketDisconnect, BackgroundTasks, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+from collections import OrderedDict
 
 # from backend.recommend_bpm import calculate_bpm
 # from backend.recommend_genre import generate
-from backend.interpret_speech import AudioLoop, MODEL, CONFIG
-from backend.recommend_bpm import get_bpm_genre
+# Heavy media/LLM libraries (cv2, pyaudio, google.genai) load on first session start
+from backend.interpret_speech import AudioLoop
+from backend.media_sources import QueueSource
+from backend.eeg_stream import StreamingBandAggregator
+from backend.eeg_cache import ParsedUploadCache
+from backend.eeg_columnar import convert_csv, load_columnar
+from backend.category import score_stress, stress_at
+from backend.eeg_trends import TREND_MAX_POINTS, TREND_STRIDE, TREND_WINDOW, trend_frame
+from backend.mental_state_history import MentalStateHistory
+from backend.mental_state_store import MentalStateStore
+from backend.state_stream import StateBroker
+from backend.shared_state import SharedStateFull, open_state_backend
+from backend.upload_store import UploadStore
 from backend.recommend_genre import generate_genre
-from backend.recommend_song import generate_songs
+from backend.recommend_song import generate_song_list_async
 
 UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20
 
-uploaded_file_path = None
+# Session registry, visible to every uvicorn worker (opened at startup)
+shared_state = None
+# Hash-named upload blobs plus a manifest per user (opened at startup)
+upload_store = None
+# Parsed frames and (bpm, wave_data) per upload, keyed by content hash (= upload id)
+upload_cache = ParsedUploadCache()
 
 app = FastAPI()
 
@@ -62,25 +76,40 @@ async def root():
             <div class="endpoint">
                 <p><strong>POST /upload</strong> - Upload a file</p>
             </div>
+            <div class="endpoint">
+                <p><strong>POST /upload/stream?filename=...</strong> - Upload a raw CSV body, scored while it streams in</p>
+            </div>
+            <div class="endpoint">
+                <p><strong>GET /uploads?user_id=...</strong> - List a user's uploads; <strong>DELETE /uploads/{upload_id}</strong> removes one</p>
+            </div>
+            <div class="endpoint">
+                <p><strong>GET /stress?user_id=...&amp;upload_id=...</strong> - Stress score, level and type for every row of an upload (per channel with per_channel=true)</p>
+            </div>
+            <div class="endpoint">
+                <p><strong>GET /trends?user_id=...&amp;window=...&amp;stride=...</strong> - Rolling band means, calmness, stress and BPM over an upload, downsampled for charting</p>
+            </div>
             
             <h2>Mental Health Analysis</h2>
             <div class="endpoint">
-                <p><strong>POST /api/analyze</strong> - Analyze text or image for mental health signals</p>
+                <p><strong>POST /api/analyze</strong> - Analyze text or image for mental health signals (body needs the sessionId)</p>
             </div>
             <div class="endpoint">
-                <p><strong>GET /api/mental-state</strong> - Get current mental state</p>
+                <p><strong>GET /api/mental-state?session_id=...</strong> - Get a session's current mental state</p>
             </div>
             <div class="endpoint">
-                <p><strong>GET /api/mental-state/history</strong> - Get history of mental states</p>
+                <p><strong>GET /api/mental-state/history?session_id=...</strong> - Get a session's history of mental states</p>
             </div>
             <div class="endpoint">
-                <p><strong>POST /api/session/start</strong> - Start a new analysis session</p>
+                <p><strong>POST /api/session/start</strong> - Start a new analysis session; returns its sessionId</p>
             </div>
             <div class="endpoint">
-                <p><strong>POST /api/session/stop</strong> - Stop the current session</p>
+                <p><strong>POST /api/session/stop?session_id=...</strong> - Stop a session</p>
             </div>
             <div class="endpoint">
-                <p><strong>WebSocket /ws</strong> - Real-time communication</p>
+                <p><strong>WebSocket /ws/media/{session_id}</strong> - Stream remote mic audio (16 kHz PCM), camera frames and text into a headless session</p>
+            </div>
+            <div class="endpoint">
+                <p><strong>WebSocket /ws</strong> - Real-time communication; send <code>{"type": "subscribe"}</code> to have mental-state changes pushed</p>
             </div>
             
             <p>For more information, see the <a href="/docs">API documentation</a>.</p>
@@ -96,10 +125,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store active sessions and mental state history (from api.py)
-active_sessions = {}
-mental_state_history = []
-
 # Define models for mental state API
 class MentalStateData(BaseModel):
     type: str
@@ -110,72 +135,606 @@ class MentalStateData(BaseModel):
 class AnalysisRequest(BaseModel):
     text: Optional[str] = None
     image: Optional[str] = None  # base64 encoded
+    sessionId: Optional[str] = None  # required; Optional only so a missing id gets a clear 400
 
 class AnalysisResponse(BaseModel):
     mentalState: Optional[Dict[str, Any]] = None
     analysis: str
     confidence: int
 
+async def _ingest_upload(chunks, filename, user_id):
+    """Write an upload to disk chunk by chunk, scoring the EEG rows as they arrive."""
+    temp_path = upload_store.temp_path()
+    aggregator = StreamingBandAggregator()
+    sha = hashlib.sha256()
+    parse_ok = True
+    try:
+        with open(temp_path, "wb") as buffer:
+            async for chunk in chunks:
+                buffer.write(chunk)
+                sha.update(chunk)
+                if parse_ok:
+                    try:
+                        aggregator.feed(chunk)
+                    except Exception as e:
+                        print(f"Streaming parse failed, recommendation will re-read the file: {e}")
+                        parse_ok = False
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    upload_id = sha.hexdigest()
+    entry, deduplicated, removed = await asyncio.to_thread(
+        upload_store.commit, temp_path, upload_id, user_id, os.path.basename(filename)
+    )
+    for evicted_id in removed:
+        upload_cache.invalidate(upload_store.blob_path(evicted_id))
+    file_path = upload_store.blob_path(upload_id)
+    if load_columnar(file_path) is None:
+        # One parse now so later readers mmap a float32 array instead of re-parsing the CSV
+        try:
+            await asyncio.to_thread(convert_csv, file_path)
+        except Exception as e:
+            print(f"Columnar conversion failed, readers will parse the CSV: {e}")
+    summary = None
+    if parse_ok:
+        try:
+            summary = aggregator.close()
+        except Exception as e:
+            print(f"Streaming parse failed, recommendation will re-read the file: {e}")
+    upload_cache.register(
+        file_path, upload_id, result=(summary["bpm"], summary["wave_data"]) if summary else None
+    )
+    response = {"filename": filename, "path": file_path, "uploadId": upload_id, "deduplicated": deduplicated}
+    if summary:
+        response["rows"] = summary["rows"]
+        response["recording"] = summary["recording"]
+    return response
+
+
+def _current_upload(user_id, upload_id=None):
+    """(blob path, upload id) of the user's upload, their latest by default."""
+    upload = upload_store.get(user_id, upload_id)
+    if upload is None:
+        raise ValueError("No EEG file uploaded yet" if upload_id is None else f"Unknown upload {upload_id}")
+    return upload_store.blob_path(upload["uploadId"]), upload["uploadId"]
+
+
+def _current_bpm_genre(user_id, upload_id=None):
+    # Any worker can serve this: manifests and blobs are on disk, and results are cached by content hash
+    return upload_cache.bpm_genre(*_current_upload(user_id, upload_id))
+
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    global uploaded_file_path  # <-- add this
-    print("called")
-    file_path = os.path.abspath(os.path.join(UPLOAD_DIR, file.filename))
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    uploaded_file_path = file_path
-    return {"filename": file.filename, "path": file_path}
+async def upload_file(file: UploadFile = File(...), user_id: str = "default"):
+    async def chunks():
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+
+    return await _ingest_upload(chunks(), file.filename, user_id)
+
+
+@app.post("/upload/stream")
+async def upload_stream(request: Request, filename: str, user_id: str = "default"):
+    """Upload a raw CSV request body, parsed as it arrives instead of after multipart spooling."""
+    return await _ingest_upload(request.stream(), filename, user_id)
+
+
+@app.get("/uploads")
+async def list_uploads(user_id: str = "default"):
+    """The user's uploads, oldest first, with their quota usage"""
+    uploads = upload_store.uploads(user_id)
+    return {
+        "uploads": uploads,
+        "usedBytes": sum(entry["size"] for entry in uploads),
+        "quotaBytes": upload_store.quota_bytes,
+    }
+
+
+@app.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str, user_id: str = "default"):
+    """Remove an upload from the user's manifest (the blob goes once nobody references it)"""
+    removed = await asyncio.to_thread(upload_store.remove, user_id, upload_id)
+    if removed is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    for evicted_id in removed:
+        upload_cache.invalidate(upload_store.blob_path(evicted_id))
+    return {"status": "deleted", "uploadId": upload_id}
+
+
+def _stress_timeline(user_id, upload_id, per_channel):
+    file_path, upload_id = _current_upload(user_id, upload_id)
+    stress = score_stress(upload_cache.frame(file_path, upload_id))
+    levels, counts = np.unique(stress["stress_level"], return_counts=True)
+    response = {
+        "uploadId": upload_id,
+        "rows": len(stress["stress_score"]),
+        "channels": stress["channels"],
+        "first": stress_at(stress, 0) if len(stress["stress_score"]) else None,
+        "meanStressScore": round(float(np.mean(stress["stress_score"])), 3) if len(stress["stress_score"]) else None,
+        "levelCounts": {str(level): int(count) for level, count in zip(levels, counts)},
+        "stressScore": np.round(stress["stress_score"], 3).tolist(),
+        "stressLevel": stress["stress_level"].tolist(),
+        "stressType": stress["stress_type"].tolist(),
+    }
+    if per_channel:
+        response["channelStressScore"] = np.round(stress["channel_stress_score"], 3).tolist()
+        response["channelStressLevel"] = stress["channel_stress_level"].tolist()
+    return response
+
+
+@app.get("/stress")
+async def stress(user_id: str = "default", upload_id: Optional[str] = None, per_channel: bool = False):
+    """Stress score, level and type for every row of an upload, scored in one vectorized pass"""
+    try:
+        return await asyncio.to_thread(_stress_timeline, user_id, upload_id, per_channel)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+TREND_SERIES = {f"{band}_mean": f"{band}Mean" for band in ("alpha", "beta", "theta", "delta", "gamma")}
+TREND_SERIES.update(calmness_score="calmnessScore", stress_score="stressScore", bpm="bpm")
+
+
+def _trend_timeline(user_id, upload_id, window, stride, max_points):
+    file_path, upload_id = _current_upload(user_id, upload_id)
+    df = upload_cache.frame(file_path, upload_id)
+    trend = trend_frame(df, window, stride, max_points)
+    response = {
+        "uploadId": upload_id,
+        "rows": len(df),
+        "window": trend["window"],
+        "stride": trend["stride"],
+        "points": len(trend["window_start"]),
+        "windowStart": trend["window_start"].tolist(),
+        "windowEnd": trend["window_end"].tolist(),
+    }
+    for key, name in TREND_SERIES.items():
+        response[name] = np.round(trend[key], 4).tolist()
+    return response
+
+
+@app.get("/trends")
+async def trends(
+    user_id: str = "default",
+    upload_id: Optional[str] = None,
+    window: int = TREND_WINDOW,
+    stride: int = TREND_STRIDE,
+    max_points: int = TREND_MAX_POINTS,
+):
+    """Rolling-window EEG trends for charting; the stride widens so at most max_points windows come back"""
+    if window < 1 or stride < 1 or max_points < 2:
+        raise HTTPException(status_code=400, detail="window and stride must be >= 1, max_points >= 2")
+    try:
+        return await asyncio.to_thread(_trend_timeline, user_id, upload_id, window, stride, max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
 # ==================== Mental Health Analysis API (from api.py) ====================
 
-class StateManager:
-    def __init__(self):
-        self.client = genai.Client(
-            http_options={"api_version": "v1beta"},
-            api_key=os.environ.get("GEMINI_API_KEY"),
-        )
+ANALYZE_MODEL = os.environ.get("ANALYZE_MODEL", "models/gemini-2.5-flash-preview")
+ANALYZE_TIMEOUT = float(os.environ.get("ANALYZE_TIMEOUT", 30))
+ANALYZE_MAX_INFLIGHT = int(os.environ.get("ANALYZE_MAX_INFLIGHT", 8))
+# How long a request may wait for an in-flight slot before getting a 503
+ANALYZE_QUEUE_TIMEOUT = float(os.environ.get("ANALYZE_QUEUE_TIMEOUT", 5))
+DISCONNECT_POLL_INTERVAL = 0.5
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 32))
+# Sessions with no analysis or state poll for this long are stopped
+SESSION_IDLE_TIMEOUT = float(os.environ.get("SESSION_IDLE_TIMEOUT", 900))
+SESSION_REAP_INTERVAL = 30
+# Append-only log of every mental state; empty disables persistence
+MENTAL_STATE_LOG = os.environ.get("MENTAL_STATE_LOG", "mental_states.log")
+# Stopped/replayed sessions whose history stays queryable
+MAX_ARCHIVED_SESSIONS = int(os.environ.get("MAX_ARCHIVED_SESSIONS", 256))
+# "adaptive" sends camera frames only on scene change (plus periodic keyframes)
+FRAME_SAMPLING = os.environ.get("FRAME_SAMPLING", "adaptive")
+# A push to a WebSocket subscriber slower than this ends its stream
+STREAM_SEND_TIMEOUT = float(os.environ.get("STREAM_SEND_TIMEOUT", 5))
+# "local" runs sessions on this machine's mic/camera; "remote" expects media
+# over /ws/media/{session_id}, for server nodes without devices
+SESSION_MEDIA = os.environ.get("SESSION_MEDIA", "local")
+# How often a worker checks the shared registry for stop requests from other workers
+SHARED_STATE_POLL_INTERVAL = 1.0
+# Description characters kept in the cross-worker copy of a mental state; the full
+# analysis stays in this worker's history and the log, and a shared entry must fit one slot
+SHARED_DESCRIPTION_CHARS = 160
+# Workers refresh their "workers" entry this often; one silent for WORKER_TIMEOUT is dead,
+# even if its pid now belongs to another process
+WORKER_HEARTBEAT_INTERVAL = 10.0
+WORKER_TIMEOUT = 3 * WORKER_HEARTBEAT_INTERVAL
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        # os.kill(pid, 0) would send CTRL_C_EVENT on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, TypeError):
+        return pid is not None
+    return True
+
+class Session:
+    """One live analysis session: its AudioLoop, current state and history."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
         self.audio_loop = None
+        # Headless loops run as a task on the server's event loop
+        self.audio_task = None
+        self.source = None
         self.is_running = False
-        self.session_id = None
+        # Set when the audio loop died on its own (e.g. no API key)
+        self.error = None
         self.analysis_results = []
         self.current_mental_state = None
-        
-    async def start_session(self, session_id):
+        self.history = MentalStateHistory()
+        self.started_at = time.time()
+        self.last_active = self.started_at
+
+    def touch(self):
+        self.last_active = time.time()
+
+    def record(self, mental_state):
+        self.current_mental_state = mental_state
+        self.history.append(mental_state)
+
+
+class StateManager:
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT, store=None, broker=None, shared=None):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        # Sessions that are no longer running, oldest first
+        self.archived = OrderedDict()
+        self.store = store
+        self.broker = broker
+        # Cross-worker registry of running sessions and their current state
+        self.shared = shared
+        # Identifies this worker process in shared entries: pid plus a per-boot uuid, so
+        # entries left by a dead worker never look alive again once its pid is reused
+        self.worker_token = None
+        self._inflight = asyncio.Semaphore(ANALYZE_MAX_INFLIGHT)
+        self._reaper = None
+        self._heartbeat = None
+        if store is not None:
+            self.attach_store(store)
+
+    def attach_store(self, store):
+        """Persist states to `store` from now on, after replaying what it already holds."""
+        self.store = store
+        self._replay(store)
+
+    def _replay(self, store):
+        """Rebuild stopped sessions' history from the persistent log."""
+        for session_id, states in store.replay().items():
+            session = Session(session_id)
+            for state in states:
+                session.record(state)
+            self._archive(session)
+
+    def _archive(self, session):
+        self.archived[session.session_id] = session
+        self.archived.move_to_end(session.session_id)
+        while len(self.archived) > MAX_ARCHIVED_SESSIONS:
+            self.archived.popitem(last=False)
+
+    def _share(self, namespace, key, value):
+        """Write (None: delete) a shared entry. A full table raises SharedStateFull."""
+        if self.shared is None:
+            return
+        try:
+            if value is None:
+                self.shared.delete(namespace, key)
+            else:
+                self.shared.set(namespace, key, value)
+        except SharedStateFull:
+            raise
+        except (ValueError, RuntimeError, OSError) as e:
+            print(f"[DEBUG] Could not update shared state {namespace}/{key}: {e}")
+
+    @staticmethod
+    def _shared_mental_state(mental_state):
+        """The compact fields other workers serve from /api/mental-state."""
+        description = str(mental_state.get("description") or "")
+        if len(description) > SHARED_DESCRIPTION_CHARS:
+            description = description[:SHARED_DESCRIPTION_CHARS].rstrip() + "..."
+        return {
+            "type": mental_state.get("type"),
+            "confidence": mental_state.get("confidence"),
+            "timestamp": mental_state.get("timestamp"),
+            "description": description,
+        }
+
+    def _record(self, session, mental_state):
+        session.record(mental_state)
+        self._share("mental_state", session.session_id, {
+            **self._shared_mental_state(mental_state),
+            "worker": self.worker_token,
+        })
+        if self.store is not None:
+            self.store.append(session.session_id, mental_state)
+        if self.broker is not None:
+            self.broker.publish(session.session_id, mental_state)
+
+    @property
+    def client(self):
+        # Built on first analysis rather than at import
+        return get_client("v1beta")
+
+    @property
+    def is_running(self):
+        return bool(self.sessions)
+
+    def get_session(self, session_id):
+        """Running or archived session by id. There is no default: with several users
+        an implicit "latest session" would hand one user's session to another."""
+        if session_id is None:
+            return None
+        return self.sessions.get(session_id) or self.archived.get(session_id)
+
+    async def start_session(self, session_id, source=None):
+        """Start a session; with a MediaSource its media comes from there instead of local devices."""
         print(f"[DEBUG] start_session called with session_id={session_id}")
-        if self.is_running:
+        if session_id in self.sessions:
             print("[DEBUG] Session already running, skipping start.")
             return False
-        self.session_id = session_id
-        print("[DEBUG] Creating AudioLoop instance...")
-        self.audio_loop = AudioLoop(video_mode="camera")
-        self.is_running = True
-        print("[DEBUG] Starting audio loop thread...")
-        threading.Thread(target=self._run_audio_loop, daemon=True).start()
+        self.archived.pop(session_id, None)
+        if len(self.sessions) >= self.max_sessions:
+            print("[DEBUG] Session limit reached, refusing start.")
+            raise HTTPException(status_code=503, detail=f"Session limit of {self.max_sessions} reached")
+        if source is None and SESSION_MEDIA == "remote":
+            # Media arrives later over /ws/media/{session_id}
+            source = QueueSource()
+        session = Session(session_id)
+        session.is_running = True
+        self.sessions[session_id] = session
+        try:
+            self._share("sessions", session_id, {
+                "pid": os.getpid(),
+                "worker": self.worker_token,
+                "startedAt": session.started_at,
+                "media": "remote" if source is not None else SESSION_MEDIA,
+            })
+        except SharedStateFull as e:
+            del self.sessions[session_id]
+            print(f"[DEBUG] Shared session registry is full: {e}")
+            raise HTTPException(status_code=503, detail=f"Shared session registry is full: {e}")
+        if source is not None:
+            print("[DEBUG] Starting headless audio loop...")
+            session.source = source
+            session.audio_loop = AudioLoop(source=source)
+            session.audio_task = asyncio.create_task(self._run_headless(session))
+        else:
+            print("[DEBUG] Creating AudioLoop instance...")
+            session.audio_loop = AudioLoop(video_mode="camera", frame_sampling=FRAME_SAMPLING)
+            print("[DEBUG] Starting audio loop thread...")
+            threading.Thread(
+                target=self._run_audio_loop, args=(session, asyncio.get_running_loop()), daemon=True
+            ).start()
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle_sessions())
         print("[DEBUG] Session started.")
         return True
-    
-    def _run_audio_loop(self):
-        asyncio.run(self.audio_loop.run())
-    
-    async def stop_session(self):
-        if not self.is_running:
+
+    async def _run_headless(self, session):
+        audio_loop = session.audio_loop
+        await audio_loop.run()
+        self._audio_loop_ended(session, audio_loop)
+
+    def _run_audio_loop(self, session, loop):
+        audio_loop = session.audio_loop
+        asyncio.run(audio_loop.run())
+        loop.call_soon_threadsafe(self._audio_loop_ended, session, audio_loop)
+
+    def _audio_loop_ended(self, session, audio_loop):
+        """A session whose loop ended without stop_session is no longer running; stop it."""
+        if self.sessions.get(session.session_id) is not session or session.audio_loop is not audio_loop:
+            return
+        session.error = audio_loop.error
+        print(f"[DEBUG] Audio loop of session {session.session_id} ended: {session.error or 'finished'}")
+        asyncio.create_task(self.stop_session(session.session_id))
+
+    async def stop_session(self, session_id):
+        if session_id is None:
             return False
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return self._request_remote_stop(session_id)
         # Stop the audio loop
-        if self.audio_loop:
+        if session.audio_loop:
             try:
-                self.audio_loop.stop()
+                session.audio_loop.stop()
             except Exception:
                 pass
-        self.is_running = False
-        self.audio_loop = None
+        if session.audio_task:
+            session.audio_task.cancel()
+        session.is_running = False
+        session.audio_loop = None
+        session.audio_task = None
+        session.source = None
+        self._archive(session)
+        self._share("sessions", session_id, None)
+        self._share("mental_state", session_id, None)
         return True
-    
-    async def get_current_state(self):
-        return self.current_mental_state
-    
-    async def analyze_input(self, text=None, image=None):
+
+    def _live_owner(self, session_id):
+        """Shared registry entry of a session running on a live worker, else None."""
+        if self.shared is None or session_id is None:
+            return None
+        entry = self.shared.get("sessions", session_id)
+        if entry is None or not self._worker_alive(entry.get("worker")):
+            return None
+        return entry
+
+    def _adopt(self, session, shared_state):
+        """Take in a state another worker analysed for this worker's session."""
+        mental_state = {key: value for key, value in shared_state.items() if key != "worker"}
+        current = session.current_mental_state or {}
+        if mental_state.get("timestamp") == current.get("timestamp"):
+            return
+        session.touch()
+        session.record(mental_state)
+        if self.broker is not None:
+            self.broker.publish(session.session_id, mental_state)
+
+    def remote_history(self, session_id):
+        """History of a session this worker does not hold, rebuilt from the log every worker
+        appends to. Without a log, a session running on another worker is a 409 naming it."""
+        owner = self._live_owner(session_id)
+        if self.store is not None:
+            states = self.store.read_session(session_id)
+            if not states and owner is None:
+                return None
+            history = MentalStateHistory()
+            for state in states:
+                history.append(state)
+            return history
+        if owner is not None:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Session {session_id} runs on worker pid {owner.get('pid')}; its history is only kept there",
+            )
+        return None
+
+    def _request_remote_stop(self, session_id):
+        """Ask the worker that owns session_id to stop it."""
+        if self.shared is None or session_id is None:
+            return False
+        entry = self.shared.get("sessions", session_id)
+        if entry is None or entry.get("worker") == self.worker_token:
+            return False
+        entry["stopRequested"] = True
+        self._share("sessions", session_id, entry)
+        return True
+
+    def list_sessions(self):
+        """Sessions running in any worker, from the shared registry."""
+        if self.shared is None:
+            return {
+                s.session_id: {"pid": os.getpid(), "startedAt": s.started_at, "lastActive": s.last_active}
+                for s in self.sessions.values()
+            }
+        entries = self.shared.items("sessions")
+        workers = self.shared.items("workers")
+        for session_id, entry in list(entries.items()):
+            if not self._worker_alive(entry.get("worker"), workers):
+                # Left behind by a worker that died
+                self._share("sessions", session_id, None)
+                self._share("mental_state", session_id, None)
+                del entries[session_id]
+            elif session_id in self.sessions:
+                entry["lastActive"] = self.sessions[session_id].last_active
+        return entries
+
+    def _worker_alive(self, token, workers=None):
+        """Whether the worker that wrote `token` into an entry still runs and heartbeats."""
+        if token is None:
+            return False
+        if token == self.worker_token:
+            return True
+        entry = (workers if workers is not None else self.shared.items("workers")).get(token)
+        return (
+            entry is not None
+            and time.time() - entry.get("heartbeat", 0) < WORKER_TIMEOUT
+            and _pid_alive(entry.get("pid"))
+        )
+
+    def register_worker(self):
+        """Pick this process's boot token and announce it in the shared registry,
+        after dropping what dead workers left there."""
+        import uuid
+        self.worker_token = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self.prune_shared()
+        self._beat()
+
+    def start_heartbeat(self):
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._beat_forever())
+
+    def _beat(self):
+        self._share("workers", self.worker_token, {"pid": os.getpid(), "heartbeat": time.time()})
+
+    async def _beat_forever(self):
+        while True:
+            await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+            try:
+                await asyncio.to_thread(self._beat)
+            except SharedStateFull as e:
+                print(f"[DEBUG] Could not refresh worker heartbeat: {e}")
+
+    async def unregister_worker(self):
+        """Stop this worker's sessions and remove every shared entry it wrote."""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        for session_id in list(self.sessions):
+            await self.stop_session(session_id)
+        if self.shared is None or self.worker_token is None:
+            return
+        for session_id, entry in self.shared.items("sessions").items():
+            if entry.get("worker") == self.worker_token:
+                self._share("sessions", session_id, None)
+                self._share("mental_state", session_id, None)
+        self._share("workers", self.worker_token, None)
+
+    def prune_shared(self):
+        """Drop shared entries of sessions and workers that are gone, e.g. left in the file by a previous run."""
+        if self.shared is None:
+            return
+        for token, entry in self.shared.items("workers").items():
+            if token != self.worker_token and time.time() - entry.get("heartbeat", 0) >= WORKER_TIMEOUT:
+                self._share("workers", token, None)
+        live = self.list_sessions()
+        for session_id in self.shared.items("mental_state"):
+            if session_id not in live:
+                self._share("mental_state", session_id, None)
+
+    async def _reap_idle_sessions(self):
+        last_reap = time.monotonic()
+        while self.sessions:
+            await asyncio.sleep(SHARED_STATE_POLL_INTERVAL if self.shared is not None else SESSION_REAP_INTERVAL)
+            if self.shared is not None:
+                for session_id in list(self.sessions):
+                    entry = self.shared.get("sessions", session_id)
+                    if entry and entry.get("stopRequested"):
+                        print(f"[DEBUG] Stopping session {session_id} at another worker's request")
+                        await self.stop_session(session_id)
+                        continue
+                    shared_state = self.shared.get("mental_state", session_id)
+                    if shared_state and shared_state.get("worker") != self.worker_token:
+                        self._adopt(self.sessions[session_id], shared_state)
+            if time.monotonic() - last_reap < SESSION_REAP_INTERVAL:
+                continue
+            last_reap = time.monotonic()
+            cutoff = time.time() - self.idle_timeout
+            for session_id, session in list(self.sessions.items()):
+                if session.last_active < cutoff:
+                    print(f"[DEBUG] Reaping idle session {session_id}")
+                    await self.stop_session(session_id)
+
+    async def get_current_state(self, session_id):
+        session = self.get_session(session_id)
+        if session is None:
+            if session_id is not None and self.shared is not None:
+                # Running (or ran) on another worker
+                shared_state = self.shared.get("mental_state", session_id)
+                if shared_state is not None:
+                    shared_state.pop("worker", None)
+                return shared_state
+            return None
+        session.touch()
+        return session.current_mental_state
+
+    async def analyze_input(self, text=None, image=None, session_id=None):
         print(f"[DEBUG] analyze_input called with text={text} image={'provided' if image else 'none'}")
-        if not self.is_running:
+        if session_id is None:
+            raise HTTPException(status_code=400, detail="sessionId is required")
+        session = self.get_session(session_id)
+        if session is None and await asyncio.to_thread(self._live_owner, session_id) is not None:
+            # Runs on another worker: analyse here, then share and log the state under its id;
+            # the owning worker takes it into its history on its next registry poll
+            session = Session(session_id)
+        elif session is None or not session.is_running:
             print("[DEBUG] analyze_input called but session is not running!")
             raise HTTPException(status_code=400, detail="No active session. Please start a session before analyzing input.")
         if not self.client:
@@ -189,36 +748,47 @@ class StateManager:
         )
         if text:
             prompt += f"\n\nUser's text: {text}"
-        print("[DEBUG] Getting Gemini model...")
-        model = self.client.get_model("models/gemini-2.5-flash-preview")
-        print("[DEBUG] Sending prompt to Gemini:", prompt[:100], "...")
-        response = model.generate_content(prompt)
+        # Back-pressure: wait briefly for an in-flight slot, then shed load
+        try:
+            await asyncio.wait_for(self._inflight.acquire(), ANALYZE_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Too many analyses in flight, try again shortly")
+        try:
+            print("[DEBUG] Sending prompt to Gemini:", prompt[:100], "...")
+            response = await asyncio.wait_for(
+                self.client.aio.models.generate_content(model=ANALYZE_MODEL, contents=prompt),
+                ANALYZE_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Gemini analysis timed out")
+        finally:
+            self._inflight.release()
         print("[DEBUG] Gemini response received.")
+        session.touch()
+        return self._record_analysis(session, response.text or "")
+    
+    def _record_analysis(self, session, text_response):
         try:
-            json_str = response.text
+            json_str = text_response
             if "```json" in json_str:
                 json_str = json_str.split("```json")[1].split("```" )[0].strip()
             elif "```" in json_str:
                 json_str = json_str.split("```" )[1].split("```" )[0].strip()
             result = json.loads(json_str)
-            self.current_mental_state = {
+            self._record(session, {
                 "type": result.get("mentalState", "Unknown"),
                 "confidence": result.get("confidence", 50),
                 "description": result.get("analysis", "No analysis available"),
                 "timestamp": self._get_timestamp()
-            }
-            mental_state_history.append(self.current_mental_state)
-            if len(mental_state_history) > 20:
-                mental_state_history.pop(0)
-            print(f"[DEBUG] Gemini JSON parsed: {self.current_mental_state}")
+            })
+            print(f"[DEBUG] Gemini JSON parsed: {session.current_mental_state}")
             return {
-                "mentalState": self.current_mental_state,
+                "mentalState": session.current_mental_state,
                 "analysis": result.get("analysis", ""),
                 "confidence": result.get("confidence", 50)
             }
         except Exception as e:
             print(f"[DEBUG] Gemini JSON parse failed: {e}")
-            text_response = response.text
             mental_state = "Balanced"
             confidence = 50
             if "stress" in text_response.lower() or "anxiety" in text_response.lower() or "distress" in text_response.lower():
@@ -233,18 +803,15 @@ class StateManager:
             elif "creativ" in text_response.lower() or "imagin" in text_response.lower():
                 mental_state = "Creative"
                 confidence = 65
-            self.current_mental_state = {
+            self._record(session, {
                 "type": mental_state,
                 "confidence": confidence,
                 "description": text_response[:200] + "...",
                 "timestamp": self._get_timestamp()
-            }
-            mental_state_history.append(self.current_mental_state)
-            if len(mental_state_history) > 20:
-                mental_state_history.pop(0)
-            print(f"[DEBUG] Gemini fallback mental state: {self.current_mental_state}")
+            })
+            print(f"[DEBUG] Gemini fallback mental state: {session.current_mental_state}")
             return {
-                "mentalState": self.current_mental_state,
+                "mentalState": session.current_mental_state,
                 "analysis": text_response,
                 "confidence": confidence
             }
@@ -254,26 +821,101 @@ class StateManager:
         return datetime.datetime.now().isoformat()
 
 # Create a state manager instance
-state_manager = StateManager()
+state_manager = StateManager(broker=StateBroker())
+
+@app.on_event("startup")
+async def open_storage():
+    # Opened here, not at import, so importing main creates no files
+    global shared_state, upload_store
+    await asyncio.to_thread(os.makedirs, UPLOAD_DIR, exist_ok=True)
+    upload_store = await asyncio.to_thread(UploadStore, UPLOAD_DIR)
+    shared_state = await asyncio.to_thread(open_state_backend)
+    state_manager.shared = shared_state
+    await asyncio.to_thread(state_manager.register_worker)
+    state_manager.start_heartbeat()
+
+@app.on_event("startup")
+async def open_mental_state_store():
+    # Opened here, not at import, so importing main touches no files and starts no threads
+    if MENTAL_STATE_LOG and state_manager.store is None:
+        store = await asyncio.to_thread(MentalStateStore, MENTAL_STATE_LOG, max_sessions=MAX_ARCHIVED_SESSIONS)
+        state_manager.attach_store(store)
+
+@app.on_event("shutdown")
+async def unregister_worker():
+    # Otherwise this worker's sessions would look alive to others until its heartbeat times out
+    await state_manager.unregister_worker()
+
+@app.on_event("shutdown")
+async def flush_mental_state_store():
+    store, state_manager.store = state_manager.store, None
+    if store is not None:
+        await asyncio.to_thread(store.close)
+
+async def _cancel_on_disconnect(http_request, coro):
+    """Run `coro`, cancelling it if the HTTP client goes away first."""
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                print("[DEBUG] Client disconnected, cancelling analysis.")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        task.cancel()
 
 @app.post("/api/analyze")
-async def analyze(request: AnalysisRequest):
+async def analyze(request: AnalysisRequest, http_request: Request):
     """Analyze text or image input and return mental state assessment"""
-    result = await state_manager.analyze_input(text=request.text, image=request.image)
+    result = await _cancel_on_disconnect(
+        http_request,
+        state_manager.analyze_input(text=request.text, image=request.image, session_id=request.sessionId),
+    )
     return result
 
 @app.get("/api/mental-state")
-async def get_mental_state():
-    """Get the current mental state"""
-    current_state = await state_manager.get_current_state()
+async def get_mental_state(session_id: str):
+    """Get the session's current mental state"""
+    current_state = await state_manager.get_current_state(session_id)
     if not current_state:
         return {"mentalState": None}
     return {"mentalState": current_state}
 
 @app.get("/api/mental-state/history")
-async def get_mental_state_history():
-    """Get the history of mental states"""
-    return {"history": mental_state_history}
+async def get_mental_state_history(
+    session_id: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = 100,
+    offset: int = 0,
+    summary: bool = False,
+):
+    """Get a page of mental states, newest page first, optionally with per-minute summaries"""
+    session = state_manager.get_session(session_id)
+    if session is not None:
+        session_history = session.history
+    else:
+        # Another worker's session: from the shared log
+        session_history = await asyncio.to_thread(state_manager.remote_history, session_id)
+    if session_history is None:
+        return {"history": [], "total": 0, "offset": offset, "limit": limit, "nextOffset": None}
+    try:
+        history, total = session_history.query(since, until, limit=max(1, min(limit, 1000)), offset=max(0, offset))
+        result = {
+            "history": history,
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "nextOffset": offset + len(history) if offset + len(history) < total else None,
+        }
+        if summary:
+            result["summary"] = session_history.per_minute(since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid since/until: {e}")
+    return result
 
 @app.post("/api/session/start")
 async def start_session(background_tasks: BackgroundTasks):
@@ -288,15 +930,60 @@ async def start_session(background_tasks: BackgroundTasks):
     return {"sessionId": session_id, "status": "started"}
 
 @app.post("/api/session/stop")
-async def stop_session():
-    """Stop the current session (idempotent)"""
-    await state_manager.stop_session()
+async def stop_session(session_id: str):
+    """Stop the given session (idempotent)"""
+    await state_manager.stop_session(session_id)
     return {"status": "stopped"}
 
+@app.get("/api/sessions")
+async def list_sessions():
+    """List the sessions running in any worker"""
+    return {
+        "sessions": [
+            {"sessionId": session_id, **entry}
+            for session_id, entry in state_manager.list_sessions().items()
+        ],
+        "maxSessions": state_manager.max_sessions,
+    }
+
 # WebSocket endpoint for real-time communication
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    # Analyses run as tasks so the socket keeps reading and can cancel them on disconnect
+    pending = set()
+    # Sessions started over this socket, stopped when it disconnects
+    owned_sessions = set()
+    # Messages without a sessionId mean the session this socket started last, never another client's
+    default_session = None
+    # Replies and pushed updates come from different tasks; one sender at a time
+    send_lock = asyncio.Lock()
+    stream_task = None
+    
+    async def send(message):
+        async with send_lock:
+            await websocket.send_json(message)
+    
+    async def run_analysis(text, image, session_id):
+        try:
+            result = await state_manager.analyze_input(text=text, image=image, session_id=session_id)
+        except HTTPException as e:
+            result = {"error": e.detail, "status": e.status_code}
+        except Exception as e:
+            result = {"error": str(e)}
+        await send(result)
+    
+    async def push_states(subscription):
+        try:
+            while True:
+                for message in await subscription.next_messages():
+                    await asyncio.wait_for(send(message), STREAM_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"[DEBUG] Slow stream consumer, ending its subscription ({subscription.dropped} dropped)")
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            state_manager.broker.unsubscribe(subscription)
     
     try:
         while True:
@@ -304,33 +991,138 @@ async def websocket_endpoint(websocket: WebSocket):
             data = json.loads(data)
             
             if data.get("type") == "analyze":
-                result = await state_manager.analyze_input(
-                    text=data.get("text"), 
-                    image=data.get("image")
-                )
-                await websocket.send_json(result)
+                session_id = data.get("sessionId") or default_session
+                task = asyncio.create_task(run_analysis(data.get("text"), data.get("image"), session_id))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            
+            elif data.get("type") == "subscribe":
+                # Push state changes instead of polling GET /api/mental-state.
+                # Always one named session: a wildcard would stream every user's analyses
+                session_id = data.get("sessionId") or default_session
+                if session_id is None:
+                    await send({"status": "error", "error": "sessionId is required"})
+                    continue
+                if stream_task is not None:
+                    stream_task.cancel()
+                subscription = state_manager.broker.subscribe(session_id)
+                stream_task = asyncio.create_task(push_states(subscription))
+                await send({"status": "subscribed", "sessionId": session_id})
+                current = await state_manager.get_current_state(session_id)
+                if current is not None:
+                    subscription.offer(session_id, current)
+            
+            elif data.get("type") == "unsubscribe":
+                if stream_task is not None:
+                    stream_task.cancel()
+                    stream_task = None
+                await send({"status": "unsubscribed"})
             
             elif data.get("type") == "startSession":
                 session_id = data.get("sessionId", str(hash(websocket)))
-                success = await state_manager.start_session(session_id)
-                await websocket.send_json({"status": "started" if success else "error"})
+                try:
+                    success = await state_manager.start_session(session_id)
+                except HTTPException as e:
+                    await send({"status": "error", "error": e.detail})
+                    continue
+                if success:
+                    owned_sessions.add(session_id)
+                    default_session = session_id
+                await send({"status": "started" if success else "error", "sessionId": session_id})
             
             elif data.get("type") == "stopSession":
-                success = await state_manager.stop_session()
-                await websocket.send_json({"status": "stopped" if success else "error"})
+                session_id = data.get("sessionId") or default_session
+                success = await state_manager.stop_session(session_id)
+                owned_sessions.discard(session_id)
+                if session_id == default_session:
+                    default_session = None
+                await send({"status": "stopped" if success else "error"})
     
     except WebSocketDisconnect:
         # Clean up on disconnect
-        await state_manager.stop_session()
+        for task in list(pending):
+            task.cancel()
+        if stream_task is not None:
+            stream_task.cancel()
+        for session_id in owned_sessions:
+            await state_manager.stop_session(session_id)
+
+@app.websocket("/ws/media/{session_id}")
+async def media_websocket(websocket: WebSocket, session_id: str):
+    """Stream a remote user's media into a headless session.
+
+    Binary messages are 16 kHz mono int16 PCM; text messages are JSON
+    {"type": "audio", "data": b64}, {"type": "frame", "data": b64 JPEG} or
+    {"type": "text", "text": ...}. The model's 24 kHz PCM comes back as
+    binary messages, plus {"type": "interrupted"} when it is cut off.
+    """
+    await websocket.accept()
+    session = state_manager.sessions.get(session_id)
+    owned = False
+    if session is None:
+        source = QueueSource()
+        try:
+            await state_manager.start_session(session_id, source=source)
+        except HTTPException as e:
+            await websocket.send_json({"status": "error", "error": e.detail})
+            await websocket.close()
+            return
+        owned = True
+    elif session.source is None:
+        await websocket.send_json({"status": "error", "error": "Session is not using remote media"})
+        await websocket.close()
+        return
+    else:
+        source = session.source
+    await websocket.send_json({"status": "started", "sessionId": session_id})
+    audio_loop = state_manager.sessions[session_id].audio_loop
+    
+    async def forward_output():
+        try:
+            while (item := await source.next_output()) is not None:
+                if isinstance(item, dict):
+                    await websocket.send_json(item)
+                else:
+                    await websocket.send_bytes(item)
+            if audio_loop is not None and audio_loop.error:
+                await websocket.send_json({"status": "error", "error": audio_loop.error})
+                await websocket.close()
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+    
+    output_task = asyncio.create_task(forward_output())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if session_id in state_manager.sessions:
+                state_manager.sessions[session_id].touch()
+            if message.get("bytes") is not None:
+                source.push_audio(message["bytes"])
+                continue
+            data = json.loads(message.get("text") or "{}")
+            if data.get("type") == "audio":
+                source.push_audio(base64.b64decode(data["data"]))
+            elif data.get("type") == "frame":
+                source.push_frame({"mime_type": data.get("mimeType", "image/jpeg"), "data": data["data"]})
+            elif data.get("type") == "text":
+                source.push_text(data.get("text", ""))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        output_task.cancel()
+        if owned:
+            await state_manager.stop_session(session_id)
 
 @app.get("/recommendation")
-async def recommendation():
+async def recommendation(user_id: str = "default", upload_id: Optional[str] = None):
     try:
         # Get BPM from EEG analysis
-        bpm, wave_data = get_bpm_genre(uploaded_file_path)
+        bpm, wave_data = await asyncio.to_thread(_current_bpm_genre, user_id, upload_id)
 
         # Get corresponding genre
-        genre_json = generate_genre(bpm, wave_data)
+        genre_json = await asyncio.to_thread(generate_genre, bpm, wave_data)
 
         return {
             "bpm": bpm,
@@ -341,29 +1133,29 @@ async def recommendation():
         return {"error": str(e)}
     
 @app.get("/recommend_songs")
-async def recommend_songs():
+async def recommend_songs(user_id: str = "default", upload_id: Optional[str] = None):
     try:
         # Get BPM + wave data
-        bpm, wave_data = get_bpm_genre(uploaded_file_path)
+        bpm, wave_data = await asyncio.to_thread(_current_bpm_genre, user_id, upload_id)
         
         # Get genre from wave data
-        genre_json = generate_genre(bpm, wave_data)
+        genre_json = await asyncio.to_thread(generate_genre, bpm, wave_data)
         genre = json.loads(genre_json).get("genre")
         
-        # Generate 8 songs in a loop
-        songs = []
-        for _ in range(4):
-            song_json = generate_songs(bpm, genre)
-            try:
-                song_data = json.loads(song_json)
-            except json.JSONDecodeError:
-                return {"error": "Invalid JSON from Gemini", "raw": song_json}
-            songs.append(song_data)
+        # Generate 4 songs without blocking the event loop
+        song_json = await generate_song_list_async(bpm, genre, 4)
+        try:
+            songs = json.loads(song_json)
+        except json.JSONDecodeError:
+            return {"error": "Invalid JSON from Gemini", "raw": song_json}
+        if not songs:
+            return {"error": "Song generation failed or timed out", "bpm": bpm, "genre": genre}
         
         return {
             "bpm": bpm,
             "genre": genre,
-            "songs": songs
+            "songs": songs,
+            "partial": len(songs) < 4
         }
     except Exception as e:
         return {"error": str(e)}